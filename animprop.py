@@ -13,11 +13,13 @@ def check_obj(obj, props):
             check_clip(clip, props)
 
 def find_props(fname, props):
-    mu = Mu()
-    if not mu.read(fname):
-        print("could not read: " + fname)
-        raise
-    check_obj(mu.obj, props)
+    # only the animation curves are needed: leave the meshes undecoded, and
+    # release the file as soon as it has been checked
+    with Mu() as mu:
+        if not mu.read(fname, lazy=True):
+            print("could not read: " + fname)
+            raise
+        check_obj(mu.obj, props)
 
 for f in sys.argv[1:]:
     props = set()
@@ -19,7 +19,13 @@
 
 # <pep8 compliant>
 
-from .script import Script
+import re
+
+try:
+    from .script import Script, FastScript
+except ImportError:
+    # run as a script
+    from script import Script, FastScript
 
 class ConfigNodeError(Exception):
     def __init__(self, fname, line, message):
@@ -29,10 +35,206 @@ class ConfigNodeError(Exception):
 def cfg_error(self, msg):
     raise ConfigNodeError(self.filename, self.line, msg)
 
+class KeyIndex:
+    # key -> positions of the (key, item) pairs in a list, in list order.
+    # It catches up with items appended to the list since it was last used
+    # and starts over if it is given another list, the list got shorter or
+    # a position no longer holds its key. Other edits (inserting or removing
+    # pairs before the end) need the owner's index reset to None.
+    def __init__(self):
+        self.items = None
+        self.count = 0
+        self.positions = {}
+    def update(self, items):
+        if items is not self.items or len(items) < self.count:
+            self.items = items
+            self.count = 0
+            self.positions = {}
+        for i in range(self.count, len(items)):
+            self.positions.setdefault(items[i][0], []).append(i)
+        self.count = len(items)
+    def add(self, items, key):
+        # items[-1] has just been appended with key
+        if items is self.items and self.count == len(items) - 1:
+            self.positions.setdefault(key, []).append(self.count)
+            self.count += 1
+    def find(self, items, key):
+        self.update(items)
+        positions = self.positions.get(key, ())
+        for i in positions:
+            if items[i][0] != key:
+                self.count = 0
+                self.positions = {}
+                return self.find(items, key)
+        return positions
+
+# what the tokenizer skips between tokens on a line, and its words
+_skip = re.compile(r"(?:[^\S\n]|[\x1a\x04])*")
+_word = re.compile(r"[^\s{}=]+")
+
+class EntryScanner:
+    # Splits cfg text, fed a line at a time, into chunks holding a single
+    # top-level entry each (a value or a node), without tokenizing it
+    # completely: it follows the tokenizer's rules just far enough to track
+    # braces (// comments, quoted strings that may span lines, and values
+    # running from = to the end of the line).
+    #
+    # filter(key) is consulted for each top-level node: if false the node is
+    # skipped without being stored. If it returns a collection of keys, only
+    # the node's values with those keys are kept (when written as
+    # key = value on one line) and its child nodes are dropped. Dropped text
+    # is reduced to its line breaks so line numbers in errors stay right.
+    def __init__(self, filter=None):
+        self.filter = filter
+        self.line = 0
+        self.depth = 0
+        self.pending = False    # a top-level key waiting for = or {
+        self.in_quote = False
+        self.skip = False       # inside a node being skipped
+        self.fields = None      # keys to keep of the node being trimmed
+        self.key = None
+        self.start()
+    def start(self, line=None):
+        # the current chunk begins on line (the next line by default)
+        self.chunk = []
+        self.chunk_line = self.line + 1 if line is None else line
+        self.started = False
+    def flush(self):
+        chunk = (self.chunk_line, "".join(self.chunk))
+        self.start()
+        return chunk
+    def open_node(self):
+        self.depth += 1
+        if self.depth != 1:
+            return
+        self.pending = False
+        self.started = True
+        keep = True
+        if self.filter:
+            keep = self.filter(self.key)
+        self.skip = not keep
+        self.fields = None
+        if keep and keep is not True:
+            self.fields = keep
+    def scan(self, text):
+        # Yields the chunks of any entries completed by this line.
+        self.line += 1
+        # start of the text going to the chunk, None while skipping or
+        # trimming
+        seg = None if self.skip or self.fields is not None else 0
+        word = None             # last word, if the last token
+        pos = 0
+        while True:
+            if self.in_quote:
+                end = text.find('"', pos)
+                if end < 0:
+                    break
+                self.in_quote = False
+                pos = end + 1
+                continue
+            pos = _skip.match(text, pos).end()
+            if pos == len(text) or text[pos] == "\n":
+                break
+            if text.startswith("//", pos):
+                break
+            c = text[pos]
+            if c == "=":
+                if self.depth == 0:
+                    self.pending = False
+                    self.started = True
+                elif self.fields is not None and self.depth == 1:
+                    if (word is not None
+                            and text[word:pos].rstrip() in self.fields):
+                        # a wanted value
+                        seg = word
+                # the rest of the line is the value
+                break
+            word = None
+            if c == "{":
+                self.open_node()
+                pos += 1
+                if self.skip:
+                    # forget the key too
+                    self.start(self.line)
+                elif self.fields is not None and self.depth == 1:
+                    self.chunk.append(text[seg:pos])
+                    seg = None
+            elif c == "}":
+                pos += 1
+                if self.depth == 0:
+                    # bad, but let the parser report it
+                    self.started = True
+                    continue
+                self.depth -= 1
+                if self.depth == 0:
+                    if not self.skip:
+                        if seg is None:
+                            self.chunk.append("}")
+                        else:
+                            self.chunk.append(text[seg:pos])
+                        yield self.flush()
+                    self.skip = False
+                    self.fields = None
+                    self.start(self.line)
+                    seg = pos
+            elif c == '"':
+                if self.depth == 0 and not self.pending:
+                    end = text.find('"', pos + 1)
+                    self.key = text[pos + 1:end] if end >= 0 else None
+                    self.pending = True
+                    self.started = True
+                self.in_quote = True
+                pos += 1
+            else:
+                end = _word.match(text, pos).end()
+                if self.depth == 0 and not self.pending:
+                    self.key = text[pos:end]
+                    self.pending = True
+                    self.started = True
+                word = pos
+                pos = end
+        if self.skip:
+            # only the line breaks, for finish()
+            self.chunk.append(text[len(text.rstrip("\n")):])
+            return
+        if seg is None:
+            # keep the line break
+            self.chunk.append(text[len(text.rstrip("\n")):])
+        else:
+            self.chunk.append(text[seg:])
+        if self.depth == 0 and not self.pending and not self.in_quote:
+            if self.started:
+                yield self.flush()
+            else:
+                self.start()
+    def finish(self):
+        # Returns the unfinished chunk at the end of the text, if any.
+        # An unterminated node being skipped or trimmed has lost some of its
+        # text. Let the tokenizer report the error from what is left: an
+        # empty node (or the kept values) spanning the same lines, and the
+        # open quote if it ends in one, so the error is the same as when
+        # loading the whole text.
+        if self.skip:
+            text = "_ {" + "".join(self.chunk)
+            if self.in_quote:
+                text += '"'
+            return self.chunk_line, text
+        if self.fields is not None:
+            text = "".join(self.chunk)
+            if self.in_quote:
+                text += '"'
+            return self.chunk_line, text
+        if self.started:
+            return self.flush()
+        return None
+
 class ConfigNode:
     def __init__(self):
         self.values = []
         self.nodes = []
+        # built on the first lookup
+        self.value_index = None
+        self.node_index = None
     @classmethod
     def ParseNode(cls, node, script, top = False):
         while script.getToken(True) != None:
@@ -58,40 +260,64 @@ class ConfigNode:
         if not top:
             cfg_error(script, "unexpected end of file")
     @classmethod
-    def load(cls, text):
-        script = Script("", text, "{}=")
+    def load(cls, text, tokenizer=FastScript, line=1):
+        # tokenizer is the Script class used to split the text into tokens,
+        # line the number of the text's first line
+        script = tokenizer("", text, "{}=")
+        script.line = line
         script.error = cfg_error.__get__(script, Script)
         node = ConfigNode()
         ConfigNode.ParseNode(node, script, True)
         return node
+    @classmethod
+    def iter_load(cls, fileobj, filter=None, tokenizer=FastScript):
+        # Reads the text a line at a time, yielding its top-level entries
+        # in order as they are completed: (key, value) for values and
+        # (key, ConfigNode) for nodes. Only one entry is held at a time.
+        # See EntryScanner for filter, which can skip nodes cheaply.
+        scanner = EntryScanner(filter)
+        for text in fileobj:
+            for line, chunk in scanner.scan(text):
+                for entry in cls.load_entry(chunk, tokenizer, line):
+                    yield entry
+        chunk = scanner.finish()
+        if chunk:
+            for entry in cls.load_entry(chunk[1], tokenizer, chunk[0]):
+                yield entry
+    @classmethod
+    def load_entry(cls, text, tokenizer, line):
+        node = cls.load(text, tokenizer, line)
+        return node.values + node.nodes
+    def find_nodes(self, key):
+        if self.node_index is None:
+            self.node_index = KeyIndex()
+        return self.node_index.find(self.nodes, key)
+    def find_values(self, key):
+        if self.value_index is None:
+            self.value_index = KeyIndex()
+        return self.value_index.find(self.values, key)
     def GetNode(self, key):
-        for n in self.nodes:
-            if n[0] == key:
-                return n[1]
+        for i in self.find_nodes(key):
+            return self.nodes[i][1]
         return None
     def GetNodes(self, key):
-        nodes = []
-        for n in self.nodes:
-            if n[0] == key:
-                nodes.append(n[1])
-        return nodes
+        return [self.nodes[i][1] for i in self.find_nodes(key)]
     def GetValue(self, key):
-        for v in self.values:
-            if v[0] == key:
-                return v[1]
+        for i in self.find_values(key):
+            return self.values[i][1]
         return None
     def GetValues(self, key):
-        values = []
-        for v in self.values:
-            if v[0] == key:
-                values.append(v[1])
-        return values
+        return [self.values[i][1] for i in self.find_values(key)]
     def AddNode(self, key):
         node = ConfigNode ()
         self.nodes.append((key, node))
+        if self.node_index:
+            self.node_index.add(self.nodes, key)
         return node
     def AddValue(self, key, value):
         self.values.append((key, value))
+        if self.value_index:
+            self.value_index.add(self.values, key)
     def ToString(self, level = 0):
         text = "{ \n"
         for val in self.values:
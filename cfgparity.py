@@ -0,0 +1,111 @@
+# vim:ts=4:et
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# <pep8 compliant>
+
+# Checks that FastScript, ConfigNode.load's default tokenizer, reads .cfg and
+# .craft files exactly as Script does: the same tokens on the same lines and
+# the same nodes, or the same error. Run directly on files, directories or
+# globs (a KSP GameData, saved crafts...), it reports each file as NDJSON and
+# exits with 1 if any differ.
+
+import os
+import sys
+import time
+
+from script import Script, FastScript
+from cfgnode import ConfigNode
+from mu import find_files, run_batch
+
+def error_text(e):
+    # Script lets EOF inside a quoted string escape as an IndexError, where
+    # FastScript reports it through error()
+    if isinstance(e, IndexError):
+        return "EOF inside quoted string"
+    return str(e).split(": ", 1)[-1]
+
+def tokens(tokenizer, text):
+    # every token of the text, split as ConfigNode does, with its line
+    script = tokenizer("", text, "{}=")
+    out = []
+    try:
+        while script.getToken(True) is not None:
+            out.append((script.token, script.line))
+    except Exception as e:
+        out.append((error_text(e), script.line))
+    return out
+
+def load(tokenizer, text):
+    try:
+        return ConfigNode.load(text, tokenizer).ToString()
+    except Exception as e:
+        return error_text(e)
+
+def check_file(path):
+    # Compare both tokenizers on one file and return a report on it.
+    result = {"path": path, "ok": False, "bytes": 0}
+    start = time.perf_counter()
+    try:
+        result["bytes"] = os.path.getsize(path)
+        with open(path, "rt") as f:
+            text = f.read()
+        slow = tokens(Script, text)
+        fast = tokens(FastScript, text)
+        result["tokens"] = len(fast)
+        if slow != fast:
+            for i, (a, b) in enumerate(zip(slow + [None], fast + [None])):
+                if a != b:
+                    break
+            result["error"] = ("token %d differs: %r (Script) %r (FastScript)"
+                               % (i, a, b))
+        elif load(Script, text) != load(FastScript, text):
+            result["error"] = "ConfigNode.load results differ"
+        else:
+            result["ok"] = True
+    except Exception as e:
+        result["error"] = type(e).__name__
+        if str(e):
+            result["error"] += ": " + str(e)
+    result["time"] = time.perf_counter() - start
+    return result
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Check that FastScript "
+                                     "reads .cfg and .craft files as Script "
+                                     "does and report the results as NDJSON")
+    parser.add_argument("paths",
+                        nargs="+",
+                        metavar="FILE|DIR|GLOB",
+                        help=".cfg and .craft files, directories to search "
+                        "or globs")
+    parser.add_argument("-j",
+                        "--jobs",
+                        type=int,
+                        default=os.cpu_count() or 1,
+                        help="Number of worker processes")
+    args = parser.parse_args()
+
+    files = [path for path, name in find_files(args.paths,
+                                                (".cfg", ".craft"))]
+    return run_batch(check_file, files, args.jobs, "check_time", 4)
+
+if __name__ == "__main__":
+    sys.exit(main())
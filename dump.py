@@ -29,8 +29,9 @@ def dump_dict(thing, mu, level, dump_funcs):
             print(("%s%s = " % ("    " * level, a)) + str(attr))
 
 def dump_thing(thing, mu, level, exclude, dump_funcs):
-    for a in dir(thing):
-        if a[0] == "_" or a in ["read", "write"] or a in exclude:
+    # only the instance's own data: class attributes describe the format
+    for a in sorted(vars(thing)):
+        if a[0] == "_" or a in exclude:
             continue
         attr = getattr(thing, a)
         n = attr.__class__.__name__
@@ -71,7 +72,10 @@ def dump_list(name, mu, lst, level):
     print("%s  %s[%d]" % ("    " * level, name, len(lst)))
 
 mesh_dump_funcs = {
-    "list": dump_list
+    "list": dump_list,
+    "MuArray": dump_list,
+    "MuBoneWeights": dump_list,
+    "ndarray": dump_list,
 }
 
 def dump_mesh(name, mu, mesh, level):
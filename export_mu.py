@@ -23,15 +23,19 @@ import bpy, bmesh
 from bpy_extras.object_utils import object_data_add
 from mathutils import Vector,Matrix,Quaternion
 from pprint import pprint
+try:
+    import numpy
+except ImportError:
+    numpy = None
 from bpy_extras.io_utils import ExportHelper
 from bpy.props import BoolProperty, FloatProperty, StringProperty, EnumProperty
 from bpy.props import FloatVectorProperty, PointerProperty
 
-from .mu import MuEnum, Mu, MuColliderMesh, MuColliderSphere, MuColliderCapsule
+from .mu import MuEnum, MuWriter, MuColliderMesh, MuColliderSphere, MuColliderCapsule
 from .mu import MuObject, MuTransform, MuMesh, MuTagLayer, MuRenderer, MuLight
 from .mu import MuColliderBox, MuColliderWheel, MuMaterial, MuTexture, MuMatTex
 from .mu import MuSpring, MuFriction
-from .mu import MuAnimation, MuClip, MuCurve, MuKey
+from .mu import MuAnimation, MuClip, MuCurve, MuKey, MuKeys
 from .shader import make_shader
 from . import properties
 
@@ -295,14 +299,25 @@ light_types = {
 
 exportable_types = {bpy.types.Mesh} | light_types
 
-def make_obj(mu, obj, path = ""):
+def export_obj(mu, obj, path = ""):
     muobj = MuObject()
     muobj.transform = make_transform (obj)
     if path:
         path += "/"
     path += muobj.transform.name
-    mu.objects[path] = muobj
     muobj.tag_and_layer = make_tag_and_layer(obj)
+    # the collider is written with the object's other components, before
+    # any children
+    children = []
+    collider = None
+    for o in obj.children:
+        muprops = o.muproperties
+        if muprops.collider and muprops.collider != 'MU_COL_NONE':
+            collider = o
+            continue
+        if (o.data and type(o.data) not in exportable_types):
+            continue
+        children.append(o)
     if obj.muproperties.collider and obj.muproperties.collider != 'MU_COL_NONE':
         # colliders are children of the object representing the transform so
         # they are never exported directly.
@@ -318,15 +333,17 @@ def make_obj(mu, obj, path = ""):
             # go from Blender to Unity
             rot = Quaternion((0.5**0.5,-0.5**0.5,0,0))
             muobj.transform.localRotation = rot * muobj.transform.localRotation
-    for o in obj.children:
-        muprops = o.muproperties
-        if muprops.collider and muprops.collider != 'MU_COL_NONE':
-            muobj.collider = make_collider(mu, o)
-            continue
-        if (o.data and type(o.data) not in exportable_types):
-            continue
-        muobj.children.append(make_obj(mu, o, path))
-    return muobj
+    if collider:
+        muobj.collider = make_collider(mu, collider)
+    if path == mu.anim_root:
+        muobj.animation = make_animations(mu, mu.animations, mu.anim_root)
+    # write the object now so its meshes can be released before moving on
+    # to the children
+    mu.begin_object(muobj)
+    del muobj
+    for o in children:
+        export_obj(mu, o, path)
+    mu.end_object()
 
 def collect_animations(obj, path=""):
     animations = {}
@@ -411,11 +428,44 @@ def make_curve(mu, curve, path):
     mucurve.property = property
     mucurve.type = 0
     mucurve.wrapMode = (8, 8)
+    if mu.use_numpy:
+        mucurve.keys = make_keys(curve.keyframe_points, mult)
+        return mucurve
     mucurve.keys = []
     for key in curve.keyframe_points:
         mucurve.keys.append(make_key(key, mult))
     return mucurve
 
+def make_keys(points, mult):
+    # make_key for all the points at once, straight into MuKeys columns
+    fps = bpy.context.scene.render.fps
+    count = len(points)
+    co, left, right = [numpy.empty(count * 2, "f") for i in range(3)]
+    points.foreach_get("co", co)
+    points.foreach_get("handle_left", left)
+    points.foreach_get("handle_right", right)
+    co, left, right = [a.astype("d").reshape(count, 2)
+                       for a in (co, left, right)]
+    x = co[:, 0] - bpy.context.scene.frame_start
+    y = co[:, 1]
+    keys = numpy.zeros(count, MuKeys.dtype)
+    keys["time"] = x / fps
+    keys["value"] = y * mult
+    dx = (x - left[:, 0]) / fps
+    dy = (y - left[:, 1]) * mult
+    keys["tangent"][:, 0] = divide_tangents(dy, dx)
+    dx = (right[:, 0] - x) / fps
+    dy = (right[:, 1] - y) * mult
+    keys["tangent"][:, 1] = divide_tangents(dy, dx)
+    return MuKeys(keys)
+
+def divide_tangents(dy, dx):
+    # fail like make_key does on a handle level with its key, rather than
+    # writing inf or nan
+    if (dx == 0).any():
+        raise ZeroDivisionError("float division by zero")
+    return dy / dx
+
 def make_animations(mu, animations, anim_root):
     anim = MuAnimation()
     anim.clip = ""
@@ -438,19 +488,21 @@ def make_animations(mu, animations, anim_root):
 def export_object(obj, filepath):
     animations = collect_animations(obj)
     anim_root = find_path_root(animations)
-    mu = Mu()
-    mu.objects = {}
+    mu = MuWriter(filepath)
+    mu.animations = animations
+    mu.anim_root = anim_root
     mu.materials = {}
     mu.textures = {}
-    mu.obj = make_obj(mu, obj)
+    try:
+        export_obj(mu, obj)
+    except:
+        mu.abort()
+        raise
     mu.materials = list(mu.materials.values())
     mu.materials.sort(key=lambda x: x.index)
     mu.textures = list(mu.textures.values())
     mu.textures.sort(key=lambda x: x.index)
-    if anim_root:
-        anim_root_obj = mu.objects[anim_root]
-        anim_root_obj.animation = make_animations(mu, animations, anim_root)
-    mu.write(filepath)
+    mu.close()
     return mu
 
 def export_mu(operator, context, filepath):
@@ -2,6 +2,8 @@ import os
 import bpy
 from . import import_mu
 from .cfgnode import ConfigNode
+from .parts import get_extension, read_cfg_file, parse_cfg_node
+from .parts import PartCatalog, find_parts
 VERBOSE = True
 
 
@@ -79,12 +81,6 @@ def read_quaternion(value):
     return (float(quat_str[3]), -float(quat_str[0]), -float(quat_str[2]), -float(quat_str[1]))
 
 
-def get_extension(filepath):
-    ''' returns the extention of the file, without the dot'''
-    ext = os.path.splitext(filepath)[-1]
-    return ext[1:]
-
-
 def hide_by_filter(func, objects=None):
     if objects is None:
         objects = bpy.context.selected_objects
@@ -101,6 +97,17 @@ def is_fairing(obj):
     return 'fairing' in obj.name
 
 
+# The PART values used by CraftReader
+CRAFT_PART_FIELDS = frozenset(['part', 'pos', 'mir', 'rot', 'attRot', 'attN'])
+
+
+def craft_part_fields(key):
+    ''' Keep only the used values of PART nodes when reading a craft '''
+    if key == 'PART':
+        return CRAFT_PART_FIELDS
+    return False
+
+
 class CraftReader(object):
     def __init__(self):
         self.ship_name = ""
@@ -108,6 +115,8 @@ class CraftReader(object):
         self.prefabs = []
         self.nb_total_parts = 0
         self.ignored_parts = ['launchClamp1', 'fuelLine', 'strutConnector']
+        # Images loaded so far, shared by the parts using the same textures
+        self.images = import_mu.ImageIndex()
 
     def rename_data_elements(self, ob):
         ''' Rename the datas to avoid overriding while loading parts '''
@@ -131,7 +140,8 @@ class CraftReader(object):
     def read_parts_models(self, prefabs_dict, colliders, use_classic_material):
         for part in prefabs_dict.values():
             unselect_all_objects()
-            result = import_mu.import_mu(self, bpy.context, part['mu'], False, use_classic_material)
+            result = import_mu.import_mu(self, bpy.context, part['mu'], False, use_classic_material,
+                                         self.images)
             if not result == {'FINISHED'}:
                 print('Warning: Error while importing file {}'.format(os.path.basename(part['mu'])))
                 continue
@@ -220,18 +230,21 @@ class CraftReader(object):
 
     def read_craft_file(self, filepath, parts_files):
         ''' Read craft file nodes and returns parts list'''
-        with open(filepath, 'r') as craft_file:
-            craft_data = craft_file.read()
-
-        cfgnode = ConfigNode.load(craft_data)
-        # The first value must be the ship name
-        self.ship_name = cfgnode.values[0][1]
-
         craft_parts = []
-        for node in cfgnode.nodes:
-            part = self.read_craft_node(node, parts_files)
-            if part is not None and part['name'] not in self.ignored_parts:
-                craft_parts.append(part)
+        ship_name = None
+        # Stream the file: only the current PART node is held in memory, and
+        # other nodes and unused PART values are skipped without being parsed
+        with open(filepath, 'r') as craft_file:
+            entries = ConfigNode.iter_load(craft_file, craft_part_fields)
+            for key, value in entries:
+                if not isinstance(value, ConfigNode):
+                    # The first value must be the ship name
+                    if ship_name is None:
+                        ship_name = self.ship_name = value
+                    continue
+                part = self.read_craft_node((key, value), parts_files)
+                if part is not None and part['name'] not in self.ignored_parts:
+                    craft_parts.append(part)
 
         return craft_parts
 
@@ -257,104 +270,34 @@ class CraftReader(object):
         return {'FINISHED'}
 
 
-def read_cfg_file(filepath):
-    ''' reads the fields of a part.cfg file '''
-    with open(filepath, 'r') as partcfg:
-        try:
-            partcfg_data = partcfg.read()
-            cfgnode = ConfigNode.load(partcfg_data)
-            return cfgnode
-        except UnicodeDecodeError:
-            print('Bad encoding found while loading part.cfg')
-            return None
-
-
-def parse_cfg_node(cfgnode, cfgpath, root, files, parts_files):
-    ''' Reads the cfg nodes and get the part data'''
-    # The cfg is a PART node containing all the data
-    # See http://wiki.kerbalspaceprogram.com/wiki/CFG_File_Documentation
-    partname = ""
-    meshpath = None
-    rescalefactor = None
-    scale = None
-    # The mesh can be defined by a MODEL node -> parsing nodes
-    # if cfgnode.nodes[0[1].nodes is not None:
-    if cfgnode.nodes[0][1] is not None:
-        for node in cfgnode.nodes[0][1].nodes:
-            if node[0] == 'MODEL':
-                for label, value in node[1].values:
-                    if label == 'model':
-                        candidate = os.path.join(cfgpath, os.path.basename(value) + '.mu')
-                        if os.path.isfile(candidate):
-                            meshpath = candidate
-                    if label == 'scale':
-                        scale = value
-                if not meshpath:
-                    print('The corresponding mu file "{}" is not found. Looking for mesh field'.format(candidate))
-
-    # The mesh can also be defined by 'mesh' token. Also retrieving relevant part data
-    for label, value in cfgnode.nodes[0][1].values:
-        if label == 'name':
-            partname = value.strip().replace('.', '_')
-        if meshpath is None and label == 'mesh':
-            mupath = os.path.join(cfgpath, value)
-            if not os.path.isfile(mupath) or not get_extension(value) == 'mu':
-                print('Warning: [CraftReader::parse_cfg_node] The model for {} doesn''t exist or is not \
-                       a mu file (not supported). Looking for substitution mu file'.format(partname))
-                for f in files:
-                    if f.endswith('mu'):
-                        print('Warning: [CraftReader::parse_cfg_node] a substitution mu file was used. \
-                               The result may be altered')
-                        meshpath = os.path.join(root, f)
-            else:
-                meshpath = mupath
-        if label == 'rescaleFactor':
-            rescalefactor = value
-    if meshpath:
-        parts_files[partname] = dict()
-        parts_files[partname]['mu'] = meshpath
-        if rescalefactor:
-            parts_files[partname]['rescaleFactor'] = rescalefactor
-        if scale:
-            parts_files[partname]['scale'] = scale
-
-
-def check_parts_in_directory(directory):
-    ''' Scan the directory for parts (pairs of .cfg and .mu files) '''
-    parts_files = dict()
-    for root, dirs, files in os.walk(directory):
-        for name in files:
-            if get_extension(name) == 'cfg':
-                cfg_file_path = os.path.join(root, name)
-                cfgnode = read_cfg_file(cfg_file_path)
-                if cfgnode is not None:
-                    # path in cfg files are incomplete, so we need to join the full path of the cfg file
-                    cfg_directory = os.path.split(cfg_file_path)[0]
-                    parse_cfg_node(cfgnode, cfg_directory, root, files, parts_files)
-
-    return parts_files
-
-
 def import_craft(context, craft_file_path, colliders, use_classic_material=False):
     ''' Read a.craft file, retrieve .mu parts and build the ship'''
 
     colliders = False
     directory = os.path.dirname(os.path.realpath(craft_file_path))
-    available_parts_files = check_parts_in_directory(directory)
-
-    creader = CraftReader()
-    parts_craft = creader.read_craft_file(craft_file_path, available_parts_files)
-
-    used_parts_files = dict()
-    for partfile in available_parts_files:
-        if partfile in creader.prefabs:
+    # Only the parts the craft names are looked up, through the catalog if
+    # there is one (see parts.find_parts)
+    catalog = PartCatalog.default()
+    try:
+        available_parts_files = find_parts(directory, catalog)
+
+        creader = CraftReader()
+        parts_craft = creader.read_craft_file(craft_file_path,
+                                              available_parts_files)
+
+        used_parts_files = dict()
+        for partfile in creader.prefabs:
             used_parts_files[partfile] = available_parts_files[partfile]
+        nb_available_parts = len(available_parts_files)
+    finally:
+        if catalog:
+            catalog.close()
 
     # Read mu files
     creader.read_parts_models(used_parts_files, colliders, use_classic_material)
 
     print('INFO : {} were found \n  - {} were used\
-           \n  - The final ship has {} parts'.format(len(available_parts_files),
+           \n  - The final ship has {} parts'.format(nb_available_parts,
                                                      len(used_parts_files), len(parts_craft)))
     print ('Warning : {} parts were skipped'.format(creader.nb_total_parts - len(parts_craft)))
 
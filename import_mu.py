@@ -19,9 +19,14 @@
 
 # <pep8 compliant>
 
-from struct import unpack
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
 import os.path
 from math import pi, sqrt
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 import bpy
 from bpy_extras.object_utils import object_data_add
@@ -31,16 +36,31 @@ from bpy.props import BoolProperty, FloatProperty, StringProperty, EnumProperty
 from bpy.props import FloatVectorProperty, PointerProperty
 
 from .mu import MuEnum, Mu, MuColliderMesh, MuColliderSphere, MuColliderCapsule
-from .mu import MuColliderBox, MuColliderWheel
+from .mu import MuColliderBox, MuColliderWheel, MuCache
 from .shader import make_shader
 from .material import make_material
+from .texconv import convert_bump, decode_dds, decode_mbm, is_bump_dds
+from .texconv import TextureError
 from . import collider, properties
 
 EXCLUDED_OBJECTS=['flare', 'busted', 'flag']
 
+# Bump whenever decoding or converting textures changes so older cached
+# textures are ignored.
+TEXTURE_CACHE_VERSION = 2
+
 def create_uvs(mu, uvs, mesh, name):
     uvlay = mesh.uv_textures.new(name)
     uvloop = mesh.uv_layers[name]
+    if numpy:
+        # look up each loop's vertex uv in one go
+        loops = numpy.empty(len(mesh.loops), numpy.int32)
+        mesh.loops.foreach_get("vertex_index", loops)
+        uvs = numpy.asarray(uvs, numpy.float32).reshape(-1, 2)[loops]
+        uvloop.data.foreach_set("uv", uvs.reshape(-1))
+        return
+    # indexing a MuArray builds a tuple each time
+    uvs = list(uvs)
     for i, uvl in enumerate(uvloop.data):
         v = mesh.loops[i].vertex_index
         uvl.uv = uvs[v]
@@ -122,20 +142,22 @@ def create_fcurve(action, curve, propmap):
     dp, ind, mult = propmap
     fps = bpy.context.scene.render.fps
     fc = action.fcurves.new(data_path = dp, index = ind)
-    fc.keyframe_points.add(len(curve.keys))
-    for i, key in enumerate(curve.keys):
+    # curve.keys may be a MuKeys array: convert the keys only once
+    keys = list(curve.keys)
+    fc.keyframe_points.add(len(keys))
+    for i, key in enumerate(keys):
         x,y = key.time * fps, key.value * mult
         fc.keyframe_points[i].co = x, y
         fc.keyframe_points[i].handle_left_type = 'FREE'
         fc.keyframe_points[i].handle_right_type = 'FREE'
         if i > 0:
-            dist = (key.time - curve.keys[i - 1].time) / 3
+            dist = (key.time - keys[i - 1].time) / 3
             dx, dy = dist * fps, key.tangent[0] * dist * mult
         else:
             dx, dy = 10, 0.0
         fc.keyframe_points[i].handle_left = x - dx, y - dy
-        if i < len(curve.keys) - 1:
-            dist = (curve.keys[i + 1].time - key.time) / 3
+        if i < len(keys) - 1:
+            dist = (keys[i + 1].time - key.time) / 3
             dx, dy = dist * fps, key.tangent[1] * dist * mult
         else:
             dx, dy = 10, 0.0
@@ -272,42 +294,20 @@ def create_object(mu, muobj, parent, create_colliders, parents):
     parents.remove(muobj.transform.name)
     return obj
 
-def convert_bump(pixels, width, height):
-    outp = list(pixels)
-    for y in range(1, height - 1):
-        for x in range(1, width - 1):
-            index = (y * width + x) * 4
-            p = pixels[index:index + 4]
-            nx = (p[3]-128) / 127.
-            nz = (p[2]-128) / 127.
-            #n = [p[3],p[2],int(sqrt(1-nx**2-nz**2)*127 + 128),255]
-            n = [p[3],p[2],255,255]
-            outp[index:index + 4] = n
-    return outp
-
-
-def load_mbm(mbmpath):
-    mbmfile = open(mbmpath, "rb")
-    header = mbmfile.read(20)
-    magic, width, height, bump, bpp = unpack("<5i", header)
-    if magic != 0x50534b03: # "\x03KSP" as little endian
-        raise
-    if bpp == 32:
-        pixels = mbmfile.read(width * height * 4)
-    elif bpp == 24:
-        pixels = [0, 0, 0, 255] * width * height
-        for i in range(width * height):
-            p = mbmfile.read(3)
-            l = i * 4
-            pixels[l:l+3] = list(p)
-    else:
-        raise
-    if bump:
-        pixels = convert_bump(pixels, width, height)
-    return width, height, pixels
+def read_pixels(image):
+    return list(image.pixels[:])
+
+def write_pixels(image, pixels):
+    if numpy and isinstance(pixels, numpy.ndarray):
+        # blender 2.7x has no bulk access to Image.pixels: a list is the
+        # fastest way in
+        pixels = pixels.reshape(-1).tolist()
+    image.pixels[:] = pixels
 
 def load_dds(dds_image):
-    pixels = list(dds_image.pixels[:])
+    # Flips (and converts normal maps) a DDS image loaded by blender, for
+    # the textures decode_texture can't decode itself
+    pixels = read_pixels(dds_image)
     rowlen = dds_image.size[0] * 4
     height = dds_image.size[1]
     for y in range(int(height/2)):
@@ -316,51 +316,221 @@ def load_dds(dds_image):
         t = pixels[ind1 : ind1 + rowlen]
         pixels[ind1:ind1+rowlen] = pixels[ind2:ind2+rowlen]
         pixels[ind2:ind2+rowlen] = t
-    if dds_image.name[-6:-4] == "_n":
+    if is_bump_dds(dds_image.name):
         pixels = convert_bump(pixels, dds_image.size[0], height)
-    dds_image.pixels = pixels[:]
+    write_pixels(dds_image, pixels)
+    return pixels
 
-def load_image(name, path):
+def texture_cache():
+    # Decoded textures are cached as .npy files next to the parsed models,
+    # so they can be mapped instead of read. numpy is needed for both.
+    if numpy is None:
+        return None
+    return MuCache.default(".npy")
+
+def texture_key(kind, data, bump):
+    # the key covers the file contents and the conversions applied to it
+    key = hashlib.sha1()
+    key.update(("%s %s %d %d\n" % (__name__, kind, TEXTURE_CACHE_VERSION,
+                                    bump)).encode())
+    key.update(data)
+    return key.hexdigest()
+
+def get_cached_texture(cache, key):
+    # Returns the cached pixels as a (height, width, 4) float32 array
+    path = cache.get(key)
+    if not path:
+        return None
+    try:
+        pixels = numpy.load(path, mmap_mode="r", allow_pickle=False)
+    except Exception:
+        # damaged or from an incompatible version: decode again
+        return None
+    if pixels.ndim != 3 or pixels.dtype != numpy.uint8:
+        return None
+    return pixels.astype(numpy.float32) / 255
+
+def put_cached_texture(cache, key, pixels, width, height):
+    # The textures are all 8 bits per channel, so they are stored as bytes:
+    # a quarter of the size of the floats
+    pixels = numpy.asarray(pixels, numpy.float32).reshape(height, width, 4)
+    pixels = numpy.rint(numpy.clip(pixels, 0, 1) * 255).astype(numpy.uint8)
+    cache.put(key, lambda f: numpy.save(f, pixels))
+
+def texture_file_key(filepath, data):
+    ext = filepath[-4:].lower()
+    if ext == ".dds":
+        name = os.path.basename(filepath)
+        return texture_key("dds", data, is_bump_dds(name))
+    return texture_key(ext[1:], data, False)
+
+def read_texture_file(filepath):
+    # Returns the file's texture_file_key and contents, so the contents can
+    # be decoded without reading the file again
+    with open(filepath, "rb") as f:
+        data = f.read()
+    return texture_file_key(filepath, data), data
+
+def decode_texture(filepath, cache=None, key=None, data=None):
+    # The part of loading a texture that doesn't need blender, so it can run
+    # in any thread. Returns (width, height, pixels) ready for Image.pixels,
+    # or None if blender has to read the file (png, tga, and dds without
+    # numpy or in a format texconv doesn't decode). key is the file's
+    # texture_file_key and data its contents, if already known.
+    ext = filepath[-4:].lower()
+    if ext not in [".dds", ".mbm"]:
+        return None
+    if ext == ".dds" and numpy is None:
+        return None
+    if data is None:
+        with open(filepath, "rb") as f:
+            data = f.read()
+    if cache:
+        if key is None:
+            key = texture_file_key(filepath, data)
+        pixels = get_cached_texture(cache, key)
+        if pixels is not None:
+            h, w = pixels.shape[:2]
+            return w, h, pixels
+    if ext == ".dds":
+        # decoded with numpy rather than loaded by blender, then read back
+        # and flipped a float at a time
+        try:
+            name = os.path.basename(filepath)
+            w, h, pixels = decode_dds(data, is_bump_dds(name))
+        except TextureError:
+            return None
+    else:
+        w, h, pixels = decode_mbm(data)
+    if cache:
+        put_cached_texture(cache, key, pixels, w, h)
+    return w, h, pixels
+
+def map_threads(func, items, jobs=None):
+    # Runs func over items in a pool of threads (numpy, file reads and
+    # hashing release the GIL), returning the results in order.
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    jobs = min(jobs, len(items))
+    if jobs <= 1:
+        return [func(item) for item in items]
+    with ThreadPoolExecutor(jobs) as executor:
+        return list(executor.map(func, items))
+
+def decode_textures(filepaths, cache=None, jobs=None, keys=None, data=None):
+    # Runs decode_texture over the files in a pool of threads. keys are the
+    # files' texture_file_keys and data their contents, if already known.
+    if keys is None:
+        keys = [None] * len(filepaths)
+    if data is None:
+        data = [None] * len(filepaths)
+    return map_threads(lambda item: decode_texture(item[0], cache, item[1],
+                                                   item[2]),
+                       list(zip(filepaths, keys, data)), jobs)
+
+class ImageIndex:
+    # The images loaded from texture files, by the files' texture_file_key,
+    # so a texture shared by several models (the parts of a craft) is loaded
+    # and packed only once. Also tracks the file names the images are packed
+    # under.
+    def __init__(self):
+        self.images = {}
+        self.names = set()
+        for img in bpy.data.images:
+            self.names.add(os.path.basename(img.filepath))
+    def get(self, key):
+        img = self.images.get(key)
+        if img is None:
+            return None
+        try:
+            img.name
+        except ReferenceError:
+            # removed from blender since
+            del self.images[key]
+            return None
+        return img
+    def add(self, key, img):
+        self.images[key] = img
+        self.names.add(os.path.basename(img.filepath))
+
+def create_image(name, path, decoded, cache=None, images=None, key=None):
+    # decoded is decode_texture's result for the file, images the ImageIndex
+    # of the images already loaded and key the file's texture_file_key, if
+    # known (DDS pixels are only cached under it)
     img_path = os.path.join(path, name)
-    if any(name == os.path.basename(packed_img.filepath) \
-       for packed_img in bpy.data.images):
+    if images is not None:
+        used = name in images.names
+    else:
+        used = any(name == os.path.basename(packed_img.filepath) \
+                   for packed_img in bpy.data.images)
+    if used:
         # Add the directory name between the file name and the extension
         basename, ext = os.path.splitext(name)
         img_path = basename  + os.path.split(path)[-1] + ext
 
-    if name[-4:].lower() in [".png", ".tga"]:
-        img = bpy.data.images.load(os.path.join(path, name))
+    if decoded:
+        w, h, pixels = decoded
+        # with an alpha channel, as images.load gives for DXT3/5 and 32 bit
+        # textures
+        img = bpy.data.images.new(name, w, h, alpha=True)
+        write_pixels(img, pixels)
 
     elif name[-4:].lower() == ".dds":
         img = bpy.data.images.load(os.path.join(path, name))
-        load_dds(img)
+        pixels = load_dds(img)
+        if cache and key is not None:
+            put_cached_texture(cache, key, pixels, img.size[0], img.size[1])
 
-    elif name[-4:].lower() == ".mbm":
-        w,h, pixels = load_mbm(os.path.join(path, name))
-        img = bpy.data.images.new(name, w, h)
-        img.pixels[:] = map(lambda x: x / 255.0, pixels)
+    else:
+        img = bpy.data.images.load(os.path.join(path, name))
 
     # Pack image and change filepath to avoid texture overriding
     img.pack(True)
     img.filepath = img_path
+    return img
 
-def create_textures(mu, path):
+def create_textures(mu, path, images=None):
     # Note: DDS textures are previously converted to .png in exporter
     # so here the extension saved in .mu is not the good one
+    # images is the ImageIndex shared by the models being imported, if any
     extensions = [".png" ,".dds", ".mbm", ".tga"]
+    cache = texture_cache()
+    if images is None:
+        images = ImageIndex()
     #texture info is in the top level object
+    textures = []
     for tex in mu.textures:
         base = os.path.splitext(tex.name)[0]
         for e in extensions:
             name = base + e
             texture_path = os.path.join(path, name)
             if os.path.exists(texture_path):
-                load_image(name, path)
-                tx = bpy.data.textures.new(tex.name, 'IMAGE')
-                tx.use_preview_alpha = True
-                tx.image = bpy.data.images[name]
+                textures.append((tex, name))
                 break
-    pass
+    filepaths = [os.path.join(path, name) for tex, name in textures]
+    files = map_threads(read_texture_file, filepaths)
+    keys = [key for key, data in files]
+    # decode the textures not loaded yet all at once, each only once and
+    # from the contents already read, then create the images, which has to
+    # be done in the main thread
+    new = {}
+    for (key, data), filepath in zip(files, filepaths):
+        if key not in new and images.get(key) is None:
+            new[key] = (filepath, data)
+    del files
+    decoded = decode_textures([f for f, data in new.values()], cache,
+                              keys=list(new),
+                              data=[data for f, data in new.values()])
+    decoded = dict(zip(new, decoded))
+    del new
+    for (tex, name), key in zip(textures, keys):
+        img = images.get(key)
+        if img is None:
+            img = create_image(name, path, decoded[key], cache, images, key)
+            images.add(key, img)
+        tx = bpy.data.textures.new(tex.name, 'IMAGE')
+        tx.use_preview_alpha = True
+        tx.image = img
 
 def add_texture(mu, mat, mattex):
     i, s, o = mattex.index, mattex.scale, mattex.offset
@@ -380,7 +550,8 @@ def create_materials(mu, use_classic=False):
         else:
             mumat.material = make_shader(mumat, mu)
 
-def import_mu(self, context, filepath, create_colliders, use_classic_material=False):
+def import_mu(self, context, filepath, create_colliders, use_classic_material=False, images=None):
+    # images is the ImageIndex to share the textures with other imports
     operator = self
     undo = bpy.context.user_preferences.edit.use_global_undo
     bpy.context.user_preferences.edit.use_global_undo = False
@@ -389,13 +560,14 @@ def import_mu(self, context, filepath, create_colliders, use_classic_material=Fa
         obj.select = False
 
     mu = Mu()
-    if not mu.read(filepath):
+    # the mesh data only needs to live until it's copied into Blender
+    if not mu.read(filepath, compact=True):
         bpy.context.user_preferences.edit.use_global_undo = undo
         operator.report({'ERROR'},
             "Unrecognized format: %s %d" % (mu.magic, mu.version))
         return {'CANCELLED'}
 
-    create_textures(mu, os.path.dirname(filepath))
+    create_textures(mu, os.path.dirname(filepath), images)
     create_materials(mu, use_classic_material)
     mu.objects = {}
     obj = create_object(mu, mu.obj, None, create_colliders, [])
@@ -19,7 +19,23 @@
 
 # <pep8 compliant>
 
-from struct import pack, unpack
+import gc
+import glob
+import hashlib
+import json
+import mmap
+import os
+import sys
+import time
+from array import array
+from io import BytesIO
+from operator import itemgetter
+from struct import Struct, pack, unpack_from
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 class MuEnum:
     MODEL_BINARY = 76543
     FILE_VERSION = 4
@@ -162,32 +178,162 @@ class MuEnum:
         'TT_NORMAL_MAP':TT_NORMAL_MAP,
     }
 
-class MuTexture:
-    def __init__(self):
-        pass
-    def read(self, mu):
-        #print("MuTexture")
-        self.name = mu.read_string()
-        self.type = mu.read_int()
-        #print("   ", self.name, self.type)
-        return self
-    def write(self, mu):
-        mu.write_string(self.name)
-        mu.write_int(self.type)
+def swap_vector(v):
+    #convert between Unity's LHS and Blender's RHS (either direction)
+    return v[0], v[2], v[1]
 
-class MuMatTex:
-    def __init__(self):
-        pass
+def quat_to_blender(q):
+    # Unity is xyzw, blender is wxyz. However, Unity is left-handed and
+    # blender is right handed. To convert between LH and RH (either
+    # direction), just swap y and z and reverse the rotation direction.
+    return q[3], -q[0], -q[2], -q[1]
+
+def quat_to_unity(q):
+    return -q[1], -q[3], -q[2], q[0]
+
+def swap_tangent(t):
+    return t[0], t[2], t[1], -t[3]
+
+# field type: (struct code, value count, read conversion, write conversion)
+MuFieldTypes = {
+    "byte": ("B", 1, None, None),
+    "int": ("i", 1, None, None),
+    "uint": ("I", 1, None, None),
+    "float": ("f", 1, None, None),
+    "int2": ("i", 2, None, None),
+    "int3": ("i", 3, None, None),
+    "float2": ("f", 2, None, None),
+    "float4": ("f", 4, None, None),
+    "float16": ("f", 16, None, None),
+    "vector": ("f", 3, swap_vector, swap_vector),
+    "quaternion": ("f", 4, quat_to_blender, quat_to_unity),
+    "tangent": ("f", 4, swap_tangent, swap_tangent),
+}
+
+class MuCodec:
+    # Compiles a record layout into one precompiled Struct per run of
+    # fixed size fields, used for both reading and writing. Fields are
+    # (name, type) or (name, type, count) where type is a key of
+    # MuFieldTypes, "string", or a MuRecord subclass whose (fixed size)
+    # fields are inlined into the current run. count gives a list of that
+    # many values.
+    def __init__(self, fields):
+        self.runs = []
+        fmt, index, items = "<", 0, []
+        for field in fields:
+            if field[1] == "string":
+                if items:
+                    self.runs.append((Struct(fmt), items))
+                    fmt, index, items = "<", 0, []
+                self.runs.append((None, field[0]))
+            else:
+                item, fmt, index = self.compile_field(field, fmt, index)
+                items.append(item)
+        if items:
+            self.runs.append((Struct(fmt), items))
+
+    def compile_field(self, field, fmt, index):
+        # index is the position of the field's first value in the run.
+        # Returns (name, getter, size, write conversion, count, sub-items)
+        name, ftype = field[:2]
+        count = None
+        if len(field) > 2:
+            count = field[2]
+        if isinstance(ftype, str):
+            code, size, rconv, wconv = MuFieldTypes[ftype]
+            get = self.getter(index, size, rconv, count)
+            item = (name, get, size, wconv, count, None)
+            return item, fmt + code * size * (count or 1), index + size * (count or 1)
+        sub = []
+        for f in ftype.fields:
+            if f[1] == "string":
+                raise ValueError("MuCodec %s: %s is not fixed size"
+                                 % (name, ftype.__name__))
+            s, fmt, index = self.compile_field(f, fmt, index)
+            sub.append(s)
+        def get(values):
+            obj = ftype()
+            for s in sub:
+                setattr(obj, s[0], s[1](values))
+            return obj
+        return (name, get, 0, None, None, sub), fmt, index
+
+    def getter(self, index, size, conv, count):
+        if count is not None:
+            getters = [self.getter(index + i * size, size, conv, None)
+                       for i in range(count)]
+            return lambda values: [g(values) for g in getters]
+        if size == 1:
+            get = itemgetter(index)
+        else:
+            get = itemgetter(slice(index, index + size))
+        if conv:
+            return lambda values: conv(get(values))
+        return get
+
+    def encode(self, item, obj, values):
+        name, get, size, wconv, count, sub = item
+        data = getattr(obj, name)
+        if sub:
+            for s in sub:
+                self.encode(s, data, values)
+            return
+        if count is None:
+            data = (data,)
+        for v in data:
+            if wconv:
+                v = wconv(v)
+            if size == 1:
+                values.append(v)
+            else:
+                values.extend(v)
+
+    def read(self, obj, mu):
+        for st, items in self.runs:
+            if st is None:
+                setattr(obj, items, mu.read_string())
+                continue
+            values = mu.read_struct(st)
+            for item in items:
+                setattr(obj, item[0], item[1](values))
+        return obj
+
+    def write(self, obj, mu):
+        for st, items in self.runs:
+            if st is None:
+                mu.write_string(getattr(obj, items))
+                continue
+            values = []
+            for item in items:
+                self.encode(item, obj, values)
+            mu.write_struct(st, values)
+
+class MuRecord:
+    # Subclasses declare their on-disk layout in fields (see MuCodec).
+    fields = ()
+    @classmethod
+    def codec(cls):
+        codec = cls.__dict__.get("_codec")
+        if codec is None:
+            codec = cls._codec = MuCodec(cls.fields)
+        return codec
     def read(self, mu):
-        #print("MuMatTex")
-        self.index = mu.read_int()
-        self.scale = mu.read_float(2)
-        self.offset = mu.read_float(2)
-        return self
+        return self.codec().read(self, mu)
     def write(self, mu):
-        mu.write_int(self.index)
-        mu.write_float(self.scale)
-        mu.write_float(self.offset)
+        self.codec().write(self, mu)
+
+class MuTexture(MuRecord):
+    fields = (
+        ("name", "string"),
+        ("type", "int"),
+    )
+
+class MuMatTex(MuRecord):
+    fields = (
+        ("index", "int"),
+        ("scale", "float2"),
+        ("offset", "float2"),
+    )
 
 def read_material4(self, mu):
     self.name = mu.read_string()
@@ -329,139 +475,262 @@ class MuMaterial:
             mu.write_int(4)
             self.textureProperties[k].write(mu)
 
-class MuTransform:
-    def __init__(self):
-        pass
-    def read(self, mu):
-        #print("MuTransform")
-        self.name = mu.read_string()
-        self.localPosition = mu.read_vector()
-        self.localRotation = mu.read_quaternion()
-        self.localScale = mu.read_vector()
-        #print("   ", self.name, self.localPosition, self.localRotation,
-        #      self.localScale)
-        return self
-    def write(self, mu):
-        mu.write_string(self.name)
-        mu.write_vector(self.localPosition)
-        mu.write_quaternion(self.localRotation)
-        mu.write_vector(self.localScale)
+class MuTransform(MuRecord):
+    fields = (
+        ("name", "string"),
+        ("localPosition", "vector"),
+        ("localRotation", "quaternion"),
+        ("localScale", "vector"),
+    )
 
-class MuTagLayer:
-    def __init__(self):
-        pass
-    def read(self, mu):
-        #print("MuTagLayer")
-        self.tag = mu.read_string()
-        self.layer = mu.read_int()
-        #print("   ", self.tag, self.layer)
-        return self
+class MuTagLayer(MuRecord):
+    fields = (
+        ("tag", "string"),
+        ("layer", "int"),
+    )
     def write(self, mu):
         mu.write_int(MuEnum.ET_TAG_AND_LAYER)
-        mu.write_string(self.tag)
-        mu.write_int(self.layer)
+        MuRecord.write(self, mu)
 
-class MuKey:
-    def __init__(self):
-        pass
-    def read(self, mu):
-        #print("MuKey")
-        self.time = mu.read_float()
-        self.value = mu.read_float()
-        self.tangent = mu.read_float(2) # in, out
-        self.tangentMode = mu.read_int()
+class MuKey(MuRecord):
+    fields = (
+        ("time", "float"),
+        ("value", "float"),
+        ("tangent", "float2"),  # in, out
         # editable, smooth, linear, stepped (0..3?)
-        #print("   ", self.time, self.value, self.tangent, self.tangentMode)
-        return self
-    def write(self, mu):
-        mu.write_float(self.time)
-        mu.write_float(self.value)
-        mu.write_float(self.tangent)
-        mu.write_int(self.tangentMode)
+        ("tangentMode", "int"),
+    )
 
-class MuCurve:
-    def __init__(self):
-        pass
+class MuKeys:
+    # A curve's keys as the columns of one structured array laid out as on
+    # disk: time, value, tangent (in, out) and tangentMode, used for compact
+    # reads. Items are MuKey objects for code expecting the list of keys.
+    if numpy is not None:
+        dtype = numpy.dtype([("time", "<f4"), ("value", "<f4"),
+                             ("tangent", "<f4", (2,)), ("tangentMode", "<i4")])
+    def __init__(self, array):
+        self.array = array
+    @property
+    def time(self):
+        return self.array["time"]
+    @property
+    def value(self):
+        return self.array["value"]
+    @property
+    def tangent(self):
+        return self.array["tangent"]
+    @property
+    def tangentMode(self):
+        return self.array["tangentMode"]
+    @staticmethod
+    def make_key(time, value, tangent, tangentMode):
+        key = MuKey()
+        key.time = time
+        key.value = value
+        key.tangent = tuple(tangent)
+        key.tangentMode = tangentMode
+        return key
+    def __len__(self):
+        return len(self.array)
+    def __getitem__(self, index):
+        rows = self.array[index]
+        columns = [rows[name].tolist() for name in self.dtype.names]
+        if not isinstance(index, slice):
+            return self.make_key(*columns)
+        return [self.make_key(*rec) for rec in zip(*columns)]
+    def __iter__(self):
+        for i in range(0, len(self), 4096):
+            for key in self[i:i + 4096]:
+                yield key
+    def __array__(self, dtype=None, copy=None):
+        if copy:
+            return numpy.array(self.array, dtype)
+        return numpy.asarray(self.array, dtype)
+    def __repr__(self):
+        return "MuKeys(%d)" % len(self)
+
+class MuCurve(MuRecord):
+    fields = (
+        ("path", "string"),
+        ("property", "string"),
+        ("type", "int"),
+        ("wrapMode", "int2"),   # pre, post
+    )
     def read(self, mu):
-        #print("MuCurve")
-        self.path = mu.read_string()
-        self.property = mu.read_string()
-        self.type = mu.read_int()
-        self.wrapMode = mu.read_int(2)  # pre, post
-        #print("   ", self.path, self.property, self.type, self.wrapMode)
+        MuRecord.read(self, mu)
         num_keys = mu.read_int()
-        #print(num_keys)
+        if mu.use_numpy and mu.compact:
+            data = mu.read_bytes(num_keys * MuKeys.dtype.itemsize)
+            data = numpy.frombuffer(data, MuKeys.dtype)
+            self.keys = MuKeys(data.copy())
+            return self
+        data = mu.unpack("<" + "ffffi" * num_keys, num_keys * 20)
         self.keys = []
-        for i in range(num_keys):
-            self.keys.append(MuKey().read(mu))
+        for i in range(0, len(data), 5):
+            self.keys.append(MuKeys.make_key(data[i], data[i + 1],
+                                             data[i + 2:i + 4], data[i + 4]))
         return self
     def write(self, mu):
-        mu.write_string(self.path)
-        mu.write_string(self.property)
-        mu.write_int(self.type)
-        mu.write_int(self.wrapMode)
+        MuRecord.write(self, mu)
         mu.write_int(len(self.keys))
+        if mu.is_array(self.keys):
+            data = numpy.asarray(self.keys, MuKeys.dtype)
+            mu.write_bytes(data.tobytes())
+            return
         for key in self.keys:
             key.write(mu)
 
-class MuClip:
+class MuClip(MuRecord):
+    fields = (
+        ("name", "string"),
+        ("lbCenter", "vector"),
+        ("lbSize", "vector"),
+        ("wrapMode", "int"),
+    )
     def __init__(self):
         self.curves = []
     def read(self, mu):
-        #print("MuClip")
-        self.name = mu.read_string()
-        self.lbCenter = mu.read_vector()
-        self.lbSize = mu.read_vector()
-        self.wrapMode = mu.read_int()
-        #print("   ", self.name, self.lbCenter, self.lbSize, self.wrapMode)
+        MuRecord.read(self, mu)
         num_curves = mu.read_int()
         for i in range(num_curves):
             self.curves.append(MuCurve().read(mu))
         return self
     def write(self, mu):
-        mu.write_string(self.name)
-        mu.write_vector(self.lbCenter)
-        mu.write_vector(self.lbSize)
-        mu.write_int(self.wrapMode)
+        MuRecord.write(self, mu)
         mu.write_int(len(self.curves))
         for curve in self.curves:
             curve.write(mu)
 
-class MuAnimation:
+class MuAnimation(MuRecord):
+    # follows the list of clips
+    fields = (
+        ("clip", "string"),
+        ("autoPlay", "byte"),   #XXX is this right?
+    )
     def __init__(self):
         self.clips = []
     def read(self, mu):
-        #print("MuAnimation")
         num_clips = mu.read_int()
         for i in range(num_clips):
             self.clips.append(MuClip().read(mu))
-        self.clip = mu.read_string()
-        self.autoPlay = mu.read_byte()
-        #print(self.clip, self.autoPlay)
-        return self
+        return MuRecord.read(self, mu)
     def write(self, mu):
         mu.write_int(MuEnum.ET_ANIMATION)
         mu.write_int(len(self.clips))
         for clip in self.clips:
             clip.write(mu)
-        mu.write_string(self.clip)
-        mu.write_byte(self.autoPlay)  #XXX is this right?
+        MuRecord.write(self, mu)
+
+class MuArray:
+    # Compact storage for a block of fixed width records (vertices, uvs,
+    # triangles...): a (count, width) numpy array, or a flat array.array when
+    # numpy isn't available. Indexing and iteration yield tuples so code
+    # written for the lists of tuples keeps working.
+    def __init__(self, array, width):
+        self.array = array
+        self.width = width
+    def __len__(self):
+        if hasattr(self.array, "shape"):
+            return self.array.shape[0]
+        return len(self.array) // self.width
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if hasattr(self.array, "shape"):
+            return tuple(self.array[index].tolist())
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError("MuArray index out of range")
+        w = self.width
+        return tuple(self.array[index * w:(index + 1) * w])
+    def __iter__(self):
+        # convert a chunk at a time so iterating doesn't expand the whole
+        # array into tuples
+        for i in range(0, len(self), 4096):
+            for rec in self[i:i + 4096]:
+                yield rec
+    def __array__(self, dtype=None, copy=None):
+        data = numpy.asarray(self.array, dtype).reshape(-1, self.width)
+        if copy:
+            data = data.copy()
+        return data
+    def __repr__(self):
+        return "MuArray(%d x %d)" % (len(self), self.width)
+
+_bone_weight = Struct("<" + "if" * 4)
 
 class MuBoneWeight:
+    # indices and weights are interleaved on disk
     def __init__(self):
         self.indices = []
         self.weights = []
     def read(self, mu):
-        for i in range(4):
-            self.indices.append(mu.read_int())
-            self.weights.append(mu.read_float())
+        data = mu.read_struct(_bone_weight)
+        self.indices = list(data[0::2])
+        self.weights = list(data[1::2])
         return self
     def write(self, mu):
+        data = []
         for i in range(4):
-            mu.write_int(self.indices[i])
-            mu.write_float(self.weights[i])
+            data.append(self.indices[i])
+            data.append(self.weights[i])
+        mu.write_struct(_bone_weight, data)
+
+class MuBoneWeights:
+    # All of a mesh's bone weights in one (count, 4) structured array of
+    # (index, weight) pairs, interleaved as on disk. Items are MuBoneWeight
+    # objects for code expecting the per-vertex list.
+    if numpy is not None:
+        dtype = numpy.dtype([("index", "<i4"), ("weight", "<f4")])
+    def __init__(self, array):
+        self.array = array
+    @property
+    def indices(self):
+        return self.array["index"]
+    @property
+    def weights(self):
+        return self.array["weight"]
+    def __len__(self):
+        return len(self.array)
+    def __getitem__(self, index):
+        rows = self.array[index]
+        if not isinstance(index, slice):
+            bw = MuBoneWeight()
+            bw.indices = rows["index"].tolist()
+            bw.weights = rows["weight"].tolist()
+            return bw
+        weights = []
+        for ind, wgt in zip(rows["index"].tolist(), rows["weight"].tolist()):
+            bw = MuBoneWeight()
+            bw.indices = ind
+            bw.weights = wgt
+            weights.append(bw)
+        return weights
+    def __iter__(self):
+        for i in range(0, len(self), 4096):
+            for bw in self[i:i + 4096]:
+                yield bw
+    def __array__(self, dtype=None, copy=None):
+        if copy:
+            return numpy.array(self.array, dtype)
+        return numpy.asarray(self.array, dtype)
+    def __repr__(self):
+        return "MuBoneWeights(%d)" % len(self)
 
 class MuMesh:
+    # attributes holding the (possibly lazily decoded) mesh data
+    arrays = ("verts", "uvs", "uv2s", "normals", "tangents", "boneWeights",
+              "bindPoses", "submeshes")
+    # bytes per vertex of the per-vertex blocks
+    vertex_block_sizes = {
+        MuEnum.ET_MESH_VERTS: 12,
+        MuEnum.ET_MESH_UV: 8,
+        MuEnum.ET_MESH_UV2: 8,
+        MuEnum.ET_MESH_NORMALS: 12,
+        MuEnum.ET_MESH_TANGENTS: 16,
+        MuEnum.ET_MESH_BONE_WEIGHTS: 32,
+    }
     def __init__(self):
         self.verts = []
         self.uvs = []
@@ -471,106 +740,193 @@ class MuMesh:
         self.boneWeights = []
         self.bindPoses = []
         self.submeshes = []
+    def __getattr__(self, name):
+        # only called for missing attributes: decode a lazily read mesh on
+        # first access to its data
+        if name not in MuMesh.arrays or "_source" not in self.__dict__:
+            raise AttributeError(name)
+        self.decode()
+        return getattr(self, name)
     def read(self, mu):
         #print("MuMesh")
         start = mu.read_int()
         if start != MuEnum.ET_MESH_START:
             raise
         num_verts, submesh_count = mu.read_int(2)
+        if mu.lazy:
+            return self.scan(mu, num_verts, submesh_count)
+        return self.read_blocks(mu, num_verts)
+    def scan(self, mu, num_verts, submesh_count):
+        # Record the header and skip over the data blocks. The data is
+        # decoded by decode() when first accessed.
+        self.num_verts = num_verts
+        self.submesh_count = submesh_count
+        self.blocks = []
+        for name in MuMesh.arrays:
+            delattr(self, name)
+        self._source = mu, mu.pos
+        while True:
+            type = mu.read_int()
+            if type == MuEnum.ET_MESH_END:
+                break
+            self.blocks.append(type)
+            if type in MuMesh.vertex_block_sizes:
+                size = num_verts * MuMesh.vertex_block_sizes[type]
+            elif type == MuEnum.ET_MESH_BIND_POSES:
+                size = mu.read_int() * 64
+            elif type == MuEnum.ET_MESH_TRIANGLES:
+                size = mu.read_int() // 3 * 12
+            else:
+                raise ValueError("MuMesh %x %d" % (mu.pos, type))
+            mu.read_bytes(size)
+        return self
+    def decode(self):
+        mu, offset = self._source
+        if "data" not in mu.__dict__:
+            raise ValueError("mesh data read after its Mu was closed")
+        del self._source
+        MuMesh.__init__(self)
+        pos = mu.pos
+        mu.pos = offset
+        try:
+            self.read_blocks(mu, self.num_verts)
+        finally:
+            mu.pos = pos
+    def read_blocks(self, mu, num_verts):
         while True:
             type = mu.read_int()
             if type == MuEnum.ET_MESH_END:
                 break
             elif type == MuEnum.ET_MESH_VERTS:
                 #print("    verts")
-                for i in range(num_verts):
-                    self.verts.append(mu.read_vector())
+                self.verts = mu.read_vectors(num_verts)
             elif type == MuEnum.ET_MESH_UV:
                 #print("    uvs")
-                for i in range(num_verts):
-                    self.uvs.append(mu.read_float(2))
+                self.uvs = mu.read_floats(num_verts, 2)
             elif type == MuEnum.ET_MESH_UV2:
                 #print("    uv2s")
-                for i in range(num_verts):
-                    self.uv2s.append(mu.read_float(2))
+                self.uv2s = mu.read_floats(num_verts, 2)
             elif type == MuEnum.ET_MESH_NORMALS:
                 #print("    normals")
-                for i in range(num_verts):
-                    self.normals.append(mu.read_vector())
+                self.normals = mu.read_vectors(num_verts)
             elif type == MuEnum.ET_MESH_TANGENTS:
                 #print("    tangents")
-                for i in range(num_verts):
-                    self.tangents.append(mu.read_tangent())
+                self.tangents = mu.read_tangents(num_verts)
             elif type == MuEnum.ET_MESH_BONE_WEIGHTS:
                 #print("    bone weights")
-                for i in range(num_verts):
-                    self.boneWeights.append(MuBoneWeight().read(mu))
+                self.boneWeights = self.read_bone_weights(mu, num_verts)
             elif type == MuEnum.ET_MESH_BIND_POSES:
                 #print("    bind poses")
                 num_poses = mu.read_int()
-                for i in range(num_poses):
-                    self.bindPoses.append(mu.read_float(16))
+                self.bindPoses = self.read_bind_poses(mu, num_poses)
             elif type == MuEnum.ET_MESH_TRIANGLES:
                 #print("    sub mesh")
                 num_tris = mu.read_int()
-                tris = []
-                for i in range(int(num_tris / 3)):   #FIXME is this guaranteed?
-                    tri = mu.read_int(3)
-                    #reverse the triangle winding for Blender (because of the
-                    # LHS/RHS swap)
-                    #avoid putting 0 at the end of the list (Blender doesn't
-                    #like that)
-                    if not tri[0]:
-                        tri = tri[0], tri[2], tri[1]
-                    else:
-                        tri = tri[2], tri[1], tri[0]
-                    tris.append(tri)
-                self.submeshes.append(tris)
+                #FIXME is num_tris % 3 == 0 guaranteed?
+                self.submeshes.append(self.read_triangles(mu, num_tris // 3))
             else:
-                raise ValueError("MuMesh %x %d" % (mu.file.tell(), type))
+                raise ValueError("MuMesh %x %d" % (mu.pos, type))
         return self
+    def read_bone_weights(self, mu, count):
+        if mu.use_numpy:
+            data = mu.read_bytes(count * _bone_weight.size)
+            data = numpy.frombuffer(data, MuBoneWeights.dtype).reshape(count, 4)
+            if mu.compact:
+                return MuBoneWeights(data.copy())
+            return list(MuBoneWeights(data))
+        data = mu.unpack("<" + "if" * 4 * count, count * _bone_weight.size)
+        weights = []
+        for i in range(0, len(data), 8):
+            bw = MuBoneWeight()
+            bw.indices = list(data[i:i + 8:2])
+            bw.weights = list(data[i + 1:i + 8:2])
+            weights.append(bw)
+        return weights
+    def read_bind_poses(self, mu, count):
+        if mu.use_numpy and mu.compact:
+            # one 4x4 matrix per bone
+            poses = mu.read_array("f", count, 16).reshape(count, 4, 4)
+            return poses.copy()
+        return mu.read_floats(count, 16)
+    def read_triangles(self, mu, count):
+        #reverse the triangle winding for Blender (because of the LHS/RHS
+        #swap)
+        #avoid putting 0 at the end of the list (Blender doesn't like that)
+        if mu.use_numpy:
+            tris = mu.read_array("i", count, 3)
+            rev = tris[:, ::-1].copy()
+            zero = tris[:, 0] == 0
+            rev[zero] = tris[zero][:, (0, 2, 1)]
+            return mu.records(rev)
+        if mu.compact:
+            tris = mu.read_flat("i", count * 3)
+            tris[0::3], tris[2::3] = tris[2::3], tris[0::3]
+            for i in range(2, len(tris), 3):
+                if not tris[i]:
+                    tris[i - 2:i + 1] = array("i", (0, tris[i - 2], tris[i - 1]))
+            return MuArray(tris, 3)
+        tris = []
+        for i in range(count):
+            tri = mu.read_int(3)
+            if not tri[0]:
+                tri = tri[0], tri[2], tri[1]
+            else:
+                tri = tri[2], tri[1], tri[0]
+            tris.append(tri)
+        return tris
     def write(self, mu):
         mu.write_int(MuEnum.ET_MESH_START)
         mu.write_int(len(self.verts))
         mu.write_int(len(self.submeshes))
 
         mu.write_int(MuEnum.ET_MESH_VERTS)
-        for v in self.verts:
-            mu.write_vector(v)
+        mu.write_vectors(self.verts)
         if len(self.uvs) == len(self.verts):
             mu.write_int(MuEnum.ET_MESH_UV)
-            for uv in self.uvs:
-                mu.write_float(uv)
+            mu.write_floats(self.uvs, 2)
         if len(self.uv2s) == len(self.verts):
             mu.write_int(MuEnum.ET_MESH_UV2)
-            for uv in self.uv2s:
-                mu.write_float(uv)
+            mu.write_floats(self.uv2s, 2)
         if len(self.normals) == len(self.verts):
             mu.write_int(MuEnum.ET_MESH_NORMALS)
-            for n in self.normals:
-                mu.write_vector(n)
+            mu.write_vectors(self.normals)
         if len(self.tangents) == len(self.verts):
             mu.write_int(MuEnum.ET_MESH_TANGENTS)
-            for t in self.tangents:
-                mu.write_tangent(t)
+            mu.write_tangents(self.tangents)
         if len(self.boneWeights) == len(self.verts):
             mu.write_int(MuEnum.ET_MESH_BONE_WEIGHTS)
-            for bw in self.boneWeights:
-                bw.write(mu)
+            self.write_bone_weights(mu, self.boneWeights)
         if len(self.bindPoses):
             mu.write_int(MuEnum.ET_MESH_BIND_POSES)
             mu.write_int(len(self.bindPoses))
-            for bp in self.bindPoses:
-                mu.write_float(bp)
+            mu.write_floats(self.bindPoses, 16)
         for sm in self.submeshes:
             mu.write_int(MuEnum.ET_MESH_TRIANGLES)
             mu.write_int(len(sm) * 3)
-            for tri in sm:
-                #reverse the triangle winding for Blender (because of the
-                # LHS/RHS swap)
-                tri = tri[0], tri[2], tri[1]
-                mu.write_int(tri)
+            self.write_triangles(mu, sm)
         mu.write_int(MuEnum.ET_MESH_END)
+    def write_bone_weights(self, mu, weights):
+        if mu.is_array(weights):
+            data = numpy.asarray(weights, MuBoneWeights.dtype)
+            mu.write_bytes(data.tobytes())
+            return
+        data = []
+        for bw in weights:
+            for i in range(4):
+                data.append(bw.indices[i])
+                data.append(bw.weights[i])
+        mu.write_bytes(pack("<" + "if" * 4 * len(weights), *data))
+    def write_triangles(self, mu, tris):
+        #reverse the triangle winding for Blender (because of the LHS/RHS
+        #swap)
+        if mu.is_array(tris):
+            tris = numpy.asarray(tris, "<i4").reshape(-1, 3)[:, (0, 2, 1)]
+            mu.write_bytes(tris.tobytes())
+            return
+        data = []
+        for tri in tris:
+            data += tri[0], tri[2], tri[1]
+        mu.write_bytes(pack("<%di" % len(data), *data))
 
 class MuRenderer:
     def __init__(self):
@@ -591,18 +947,21 @@ class MuRenderer:
         mu.write_int(len(self.materials))
         mu.write_int(self.materials)
 
-class MuSkinnedMeshRenderer:
+class MuSkinnedMeshRenderer(MuRecord):
+    # between the materials and the bones
+    fields = (
+        ("center", "vector"),
+        ("size", "vector"),
+        ("quality", "int"),
+        ("updateWhenOffscreen", "byte"),
+    )
     def __init__(self):
         self.materials = []
         self.bones = []
     def read(self, mu):
         num_mat = mu.read_int()
-        for i in range(num_mat):
-            self.materials.append(mu.read_int())
-        self.center = mu.read_vector()
-        self.size = mu.read_vector()
-        self.quality = mu.read_int()
-        self.updateWhenOffscreen = mu.read_byte()
+        self.materials = list(mu.read_int(num_mat, True))
+        MuRecord.read(self, mu)
         nBones = mu.read_int()
         for i in range(nBones):
             self.bones.append(mu.read_string())
@@ -612,150 +971,100 @@ class MuSkinnedMeshRenderer:
         mu.write_int(MuEnum.ET_SKINNED_MESH_RENDERER)
         mu.write_int(len(self.materials))
         mu.write_int(self.materials)
-        mu.write_vector(self.center)
-        mu.write_vector(self.size)
-        mu.write_int(self.quality)
-        mu.write_byte(self.updateWhenOffscreen)
+        MuRecord.write(self, mu)
         mu.write_int(len(self.bones))
         for bone in self.bones:
             mu.write_string(bone)
         self.mesh.write(mu)
 
-class MuCollider_Base:
+class MuCollider_Base(MuRecord):
+    # entry types for the original and the isTrigger (2) versions
+    entry_types = ()
     def __init__(self, type):
         self.type = type
-
-class MuColliderMesh(MuCollider_Base):
     def read(self, mu):
-        #print("MuColliderMesh", self.type)
-        #print(self.isTrigger, self.convex)
         self.isTrigger = 0
         if self.type:
             self.isTrigger = mu.read_byte()
-        self.convex = mu.read_byte()
-        self.mesh = MuMesh().read(mu)
-        return self
+        return MuRecord.read(self, mu)
     def write(self, mu):
         if self.type:
-            mu.write_int(MuEnum.ET_MESH_COLLIDER2)
+            mu.write_int(self.entry_types[1])
             mu.write_byte(self.isTrigger)
         else:
-            mu.write_int(MuEnum.ET_MESH_COLLIDER)
-        mu.write_byte(self.convex)
-        self.mesh.write(mu)
+            mu.write_int(self.entry_types[0])
+        MuRecord.write(self, mu)
 
-class MuColliderSphere(MuCollider_Base):
+class MuColliderMesh(MuCollider_Base):
+    entry_types = (MuEnum.ET_MESH_COLLIDER, MuEnum.ET_MESH_COLLIDER2)
+    fields = (
+        ("convex", "byte"),
+    )
     def read(self, mu):
-        #print("MuColliderSphere", self.type)
-        self.isTrigger = 0
-        if self.type:
-            self.isTrigger = mu.read_byte()
-        self.radius = mu.read_float()
-        self.center = mu.read_vector()
-        #print(self.isTrigger, self.radius, self.center)
+        MuCollider_Base.read(self, mu)
+        self.mesh = MuMesh().read(mu)
         return self
     def write(self, mu):
-        if self.type:
-            mu.write_int(MuEnum.ET_SPHERE_COLLIDER2)
-            mu.write_byte(self.isTrigger)
-        else:
-            mu.write_int(MuEnum.ET_SPHERE_COLLIDER)
-        mu.write_float(self.radius)
-        mu.write_vector(self.center)
+        MuCollider_Base.write(self, mu)
+        self.mesh.write(mu)
+
+class MuColliderSphere(MuCollider_Base):
+    entry_types = (MuEnum.ET_SPHERE_COLLIDER, MuEnum.ET_SPHERE_COLLIDER2)
+    fields = (
+        ("radius", "float"),
+        ("center", "vector"),
+    )
 
 class MuColliderCapsule(MuCollider_Base):
-    def read(self, mu):
-        #print("MuColliderCapsule", self.type)
-        self.isTrigger = 0
-        if self.type:
-            self.isTrigger = mu.read_byte()
-        self.radius = mu.read_float()
-        self.height = mu.read_float()
-        self.direction = mu.read_int()
-        self.center = mu.read_vector()
-        return self
-    def write(self, mu):
-        if self.type:
-            mu.write_int(MuEnum.ET_CAPSULE_COLLIDER2)
-            mu.write_byte(self.isTrigger)
-        else:
-            mu.write_int(MuEnum.ET_CAPSULE_COLLIDER)
-        mu.write_float(self.radius)
-        mu.write_float(self.height)
-        mu.write_int(self.direction)
-        mu.write_vector(self.center)
+    entry_types = (MuEnum.ET_CAPSULE_COLLIDER, MuEnum.ET_CAPSULE_COLLIDER2)
+    fields = (
+        ("radius", "float"),
+        ("height", "float"),
+        ("direction", "int"),
+        ("center", "vector"),
+    )
 
 class MuColliderBox(MuCollider_Base):
-    def read(self, mu):
-        #print("MuColliderBox", self.type)
-        self.isTrigger = 0
-        if self.type:
-            self.isTrigger = mu.read_byte()
-        self.size = mu.read_vector()
-        self.center = mu.read_vector()
-        #print(self.isTrigger, self.size, self.center)
-        return self
-    def write(self, mu):
-        if self.type:
-            mu.write_int(MuEnum.ET_BOX_COLLIDER2)
-            mu.write_byte(self.isTrigger)
-        else:
-            mu.write_int(MuEnum.ET_BOX_COLLIDER)
-        mu.write_vector(self.size)
-        mu.write_vector(self.center)
+    entry_types = (MuEnum.ET_BOX_COLLIDER, MuEnum.ET_BOX_COLLIDER2)
+    fields = (
+        ("size", "vector"),
+        ("center", "vector"),
+    )
 
-class MuSpring:
-    def __init__(self):
-        pass
-    def read(self, mu):
-        self.spring = mu.read_float()
-        self.damper = mu.read_float()
-        self.targetPosition = mu.read_float()
-        return self
-    def write(self, mu):
-        mu.write_float(self.spring)
-        mu.write_float(self.damper)
-        mu.write_float(self.targetPosition)
+class MuSpring(MuRecord):
+    fields = (
+        ("spring", "float"),
+        ("damper", "float"),
+        ("targetPosition", "float"),
+    )
 
-class MuFriction:
-    def __init__(self):
-        pass
-    def read(self, mu):
-        self.extremumSlip = mu.read_float()
-        self.extremumValue = mu.read_float()
-        self.asymptoteSlip = mu.read_float()
-        self.asymptoteValue = mu.read_float()
-        self.stiffness = mu.read_float()
-        return self
-    def write(self, mu):
-        mu.write_float(self.extremumSlip)
-        mu.write_float(self.extremumValue)
-        mu.write_float(self.asymptoteSlip)
-        mu.write_float(self.asymptoteValue)
-        mu.write_float(self.stiffness)
+class MuFriction(MuRecord):
+    fields = (
+        ("extremumSlip", "float"),
+        ("extremumValue", "float"),
+        ("asymptoteSlip", "float"),
+        ("asymptoteValue", "float"),
+        ("stiffness", "float"),
+    )
 
 class MuColliderWheel(MuCollider_Base):
+    fields = (
+        ("mass", "float"),
+        ("radius", "float"),
+        ("suspensionDistance", "float"),
+        ("center", "vector"),
+        ("suspensionSpring", MuSpring),
+        ("forwardFriction", MuFriction),
+        ("sidewaysFriction", MuFriction),
+    )
     def __init__(self):
         MuCollider_Base.__init__(self, 0)
     def read(self, mu):
-        #print("MuColliderWheel")
-        self.mass = mu.read_float()
-        self.radius = mu.read_float()
-        self.suspensionDistance = mu.read_float()
-        self.center = mu.read_vector()
-        self.suspensionSpring = MuSpring().read(mu)
-        self.forwardFriction = MuFriction().read(mu)
-        self.sidewaysFriction = MuFriction().read(mu)
-        return self
+        # wheel colliders have no isTrigger
+        return MuRecord.read(self, mu)
     def write(self, mu):
         mu.write_int(MuEnum.ET_WHEEL_COLLIDER)
-        mu.write_float(self.mass)
-        mu.write_float(self.radius)
-        mu.write_float(self.suspensionDistance)
-        mu.write_vector(self.center)
-        self.suspensionSpring.write(mu)
-        self.forwardFriction.write(mu)
-        self.sidewaysFriction.write(mu)
+        MuRecord.write(self, mu)
 
 def MuCollider(type):
     if type in [MuEnum.ET_MESH_COLLIDER, MuEnum.ET_MESH_COLLIDER2]:
@@ -771,127 +1080,117 @@ def MuCollider(type):
     else:
         raise ValueError("MuCollider %d" % type)
 
-class MuCamera:
-    def __init__(self):
-        pass
-    def read(self, mu):
-        self.clearFlags = mu.read_int()
-        self.backgroundColor = mu.read_float(4)
-        self.cullingMask = mu.read_int()
-        self.orthographic = mu.read_byte()
-        self.fov = mu.read_float()
-        self.near = mu.read_float()
-        self.far = mu.read_float()
-        self.dept = mu.read_float()
-        return self
+class MuCamera(MuRecord):
+    fields = (
+        ("clearFlags", "int"),
+        ("backgroundColor", "float4"),
+        ("cullingMask", "int"),
+        ("orthographic", "byte"),
+        ("fov", "float"),
+        ("near", "float"),
+        ("far", "float"),
+        ("dept", "float"),
+    )
     def write(self, mu):
         mu.write_int(MuEnum.ET_CAMERA)
-        mu.write_int(self.clearFlags)
-        mu.write_float(self.backgroundColor)
-        mu.write_int(self.cullingMask)
-        mu.write_int(self.orthographic)
-        mu.write_float(self.fov)
-        mu.write_float(self.near)
-        mu.write_float(self.far)
-        mu.write_float(self.dept)
-
-class MuParticles:
-    def __init__(self):
-        pass
-    def read(self, mu):
-        self.emit = mu.read_byte()
-        self.shape = mu.read_int()
-        self.shape3d = mu.read_vector()
-        self.shape2d = mu.read_float(2)
-        self.shape1d = mu.read_float()
-        self.color = mu.read_float(4)
-        self.useUorldSpace = mu.read_byte()
-        self.size = mu.read_float(2)    #min, max
-        self.energy = mu.read_float(2)  #min, max
-        self.emission = mu.read_int(2)  #min, max
-        self.worldVelocity = mu.read_vector()
-        self.localVelocity = mu.read_vector()
-        self.rndVelocity = mu.read_vector()
-        self.emitterVelocityScale = mu.read_float()
-        self.angularVelocity = mu.read_float()
-        self.rndAngularVelocity = mu.read_float()
-        self.rndRotation = mu.read_byte()
-        self.doesAnimateColor = mu.read_byte()
-        self.colorAnimation = [None]*5
-        for i in range(5):
-            self.colorAnimation[i] = mu.read_float(4)
-        self.worldRotationAxis = mu.read_vector()
-        self.localRotationAxis = mu.read_vector()
-        self.sizeGrow = mu.read_float()
-        self.rndForce = mu.read_vector()
-        self.force = mu.read_vector()
-        self.damping = mu.read_float()
-        self.castShadows = mu.read_byte()
-        self.recieveShadows = mu.read_byte()
-        self.lengthScale = mu.read_float()
-        self.velocityScale = mu.read_float()
-        self.maxParticleSize = mu.read_float()
-        self.particleRenderMode = mu.read_int()
-        self.uvAnimation = mu.read_int(3) #xtile, ytile, cycles
-        self.count = mu.read_int()
-        return self
-    def write(self, mu):
-        mu.write_byte(self.emit)
-        mu.write_int(self.shape)
-        mu.write_vector(self.shape3d)
-        mu.write_float(self.shape2d)
-        mu.write_float(self.shape1d)
-        mu.write_float(self.color)
-        mu.write_byte(self.useUorldSpace)
-        mu.write_float(self.size)
-        mu.write_float(self.energy)
-        mu.write_int(self.emission)
-        mu.write_vector(self.worldVelocity)
-        mu.write_vector(self.localVelocity)
-        mu.write_vector(self.rndVelocity)
-        mu.write_float(self.emitterVelocityScale)
-        mu.write_float(self.angularVelocity)
-        mu.write_float(self.rndAngularVelocity)
-        mu.write_byte(self.rndRotation)
-        mu.write_byte(self.doesAnimateColor)
-        for i in range(5):
-            mu.write_float(self.colorAnimation[i])
-        mu.write_vector(self.worldRotationAxis)
-        mu.write_vector(self.localRotationAxis)
-        mu.write_float(self.sizeGrow)
-        mu.write_vector(self.rndForce)
-        mu.write_vector(self.force)
-        mu.write_float(self.damping)
-        mu.write_byte(self.castShadows)
-        mu.write_byte(self.recieveShadows)
-        mu.write_float(self.lengthScale)
-        mu.write_float(self.velocityScale)
-        mu.write_float(self.maxParticleSize)
-        mu.write_int(self.particleRenderMode)
-        mu.write_int(self.uvAnimation)
-        mu.write_int(self.count)
-
-class MuLight:
-    def __init__(self):
-        pass
+        MuRecord.write(self, mu)
+
+class MuParticles(MuRecord):
+    fields = (
+        ("emit", "byte"),
+        ("shape", "int"),
+        ("shape3d", "vector"),
+        ("shape2d", "float2"),
+        ("shape1d", "float"),
+        ("color", "float4"),
+        ("useUorldSpace", "byte"),
+        ("size", "float2"),     #min, max
+        ("energy", "float2"),   #min, max
+        ("emission", "int2"),   #min, max
+        ("worldVelocity", "vector"),
+        ("localVelocity", "vector"),
+        ("rndVelocity", "vector"),
+        ("emitterVelocityScale", "float"),
+        ("angularVelocity", "float"),
+        ("rndAngularVelocity", "float"),
+        ("rndRotation", "byte"),
+        ("doesAnimateColor", "byte"),
+        ("colorAnimation", "float4", 5),
+        ("worldRotationAxis", "vector"),
+        ("localRotationAxis", "vector"),
+        ("sizeGrow", "float"),
+        ("rndForce", "vector"),
+        ("force", "vector"),
+        ("damping", "float"),
+        ("castShadows", "byte"),
+        ("recieveShadows", "byte"),
+        ("lengthScale", "float"),
+        ("velocityScale", "float"),
+        ("maxParticleSize", "float"),
+        ("particleRenderMode", "int"),
+        ("uvAnimation", "int3"),    #xtile, ytile, cycles
+        ("count", "int"),
+    )
+
+class MuLight(MuRecord):
+    # spotAngle (version 2 and later) follows
+    fields = (
+        ("type", "int"),
+        ("intensity", "float"),
+        ("range", "float"),
+        ("color", "float4"),
+        ("cullingMask", "uint"),
+    )
     def read(self, mu):
-        self.type = mu.read_int()
-        self.intensity = mu.read_float()
-        self.range = mu.read_float()
-        self.color = mu.read_float(4)
-        self.cullingMask = mu.read_int()
+        MuRecord.read(self, mu)
         if mu.version > 1:
             self.spotAngle = mu.read_float()
         return self
     def write(self, mu):
         mu.write_int(MuEnum.ET_LIGHT)
-        mu.write_int(self.type)
-        mu.write_float(self.intensity)
-        mu.write_float(self.range)
-        mu.write_float(self.color)
-        mu.write_uint(self.cullingMask)
+        MuRecord.write(self, mu)
         mu.write_float(self.spotAngle)
 
+def read_entry(mu, entry_type):
+    # Read the entry introduced by entry_type (anything but the child
+    # transform start and end markers). Returns the name of the MuObject
+    # attribute it belongs in (or "materials"/"textures" for the lists on
+    # the Mu object) and its value, or (None, None) for unknown entries.
+    if entry_type == MuEnum.ET_TAG_AND_LAYER:
+        return "tag_and_layer", MuTagLayer().read(mu)
+    elif entry_type in [MuEnum.ET_MESH_COLLIDER,
+                        MuEnum.ET_SPHERE_COLLIDER,
+                        MuEnum.ET_CAPSULE_COLLIDER,
+                        MuEnum.ET_BOX_COLLIDER,
+                        MuEnum.ET_MESH_COLLIDER2,
+                        MuEnum.ET_SPHERE_COLLIDER2,
+                        MuEnum.ET_CAPSULE_COLLIDER2,
+                        MuEnum.ET_BOX_COLLIDER2,
+                        MuEnum.ET_WHEEL_COLLIDER]:
+        return "collider", MuCollider(entry_type).read(mu)
+    elif entry_type == MuEnum.ET_MESH_FILTER:
+        return "shared_mesh", MuMesh().read(mu)
+    elif entry_type == MuEnum.ET_MESH_RENDERER:
+        return "renderer", MuRenderer().read(mu)
+    elif entry_type == MuEnum.ET_SKINNED_MESH_RENDERER:
+        return "skinned_mesh_renderer", MuSkinnedMeshRenderer().read(mu)
+    elif entry_type == MuEnum.ET_ANIMATION:
+        return "animation", MuAnimation().read(mu)
+    elif entry_type == MuEnum.ET_CAMERA:
+        return "camera", MuCamera().read(mu)
+    elif entry_type == MuEnum.ET_PARTICLES:
+        return "particles", MuParticles().read(mu)
+    elif entry_type == MuEnum.ET_LIGHT:
+        return "light", MuLight().read(mu)
+    elif entry_type == MuEnum.ET_MATERIALS:
+        mat_count = mu.read_int()
+        return "materials", [MuMaterial().read(mu) for i in range(mat_count)]
+    elif entry_type == MuEnum.ET_TEXTURES:
+        tex_count = mu.read_int()
+        return "textures", [MuTexture().read(mu) for i in range(tex_count)]
+    #print(entry_type, hex(mu.pos))
+    return None, None
+
 class MuObject:
     def __init__(self, name=""):
         self.name = name
@@ -904,51 +1203,26 @@ class MuObject:
                 entry_type = mu.read_int()
             except EOFError:
                 break
-            #print(entry_type, hex(mu.file.tell()))
+            #print(entry_type, hex(mu.pos))
             if entry_type == MuEnum.ET_CHILD_TRANSFORM_START:
                 self.children.append(MuObject().read(mu))
             elif entry_type == MuEnum.ET_CHILD_TRANSFORM_END:
                 break
-            elif entry_type == MuEnum.ET_TAG_AND_LAYER:
-                self.tag_and_layer = MuTagLayer().read(mu)
-            elif entry_type in [MuEnum.ET_MESH_COLLIDER,
-                                MuEnum.ET_SPHERE_COLLIDER,
-                                MuEnum.ET_CAPSULE_COLLIDER,
-                                MuEnum.ET_BOX_COLLIDER,
-                                MuEnum.ET_MESH_COLLIDER2,
-                                MuEnum.ET_SPHERE_COLLIDER2,
-                                MuEnum.ET_CAPSULE_COLLIDER2,
-                                MuEnum.ET_BOX_COLLIDER2,
-                                MuEnum.ET_WHEEL_COLLIDER]:
-                self.collider = MuCollider(entry_type).read(mu)
-            elif entry_type == MuEnum.ET_MESH_FILTER:
-                self.shared_mesh = MuMesh().read(mu)
-            elif entry_type == MuEnum.ET_MESH_RENDERER:
-                self.renderer = MuRenderer().read(mu)
-            elif entry_type == MuEnum.ET_SKINNED_MESH_RENDERER:
-                self.skinned_mesh_renderer = MuSkinnedMeshRenderer().read(mu)
-            elif entry_type == MuEnum.ET_ANIMATION:
-                self.animation = MuAnimation().read(mu)
-            elif entry_type == MuEnum.ET_CAMERA:
-                self.camera = MuCamera().read(mu)
-            elif entry_type == MuEnum.ET_PARTICLES:
-                self.particles = MuParticles().read(mu)
-            elif entry_type == MuEnum.ET_LIGHT:
-                self.light = MuLight().read(mu)
-            elif entry_type == MuEnum.ET_MATERIALS:
-                mat_count = mu.read_int()
-                for i in range(mat_count):
-                    mat = MuMaterial().read(mu)
-                    mu.materials.append(mat)
-            elif entry_type == MuEnum.ET_TEXTURES:
-                tex_count = mu.read_int()
-                for i in range(tex_count):
-                    mu.textures.append(MuTexture().read(mu))
             else:
-                #print(entry_type, hex(mu.file.tell()))
-                pass
+                attr, value = read_entry(mu, entry_type)
+                if attr in ("materials", "textures"):
+                    getattr(mu, attr).extend(value)
+                elif attr:
+                    setattr(self, attr, value)
         return self
     def write(self, mu):
+        self.write_components(mu)
+        for child in self.children:
+            mu.write_int(MuEnum.ET_CHILD_TRANSFORM_START)
+            child.write(mu)
+            mu.write_int(MuEnum.ET_CHILD_TRANSFORM_END)
+    def write_components(self, mu):
+        # everything but the children
         self.transform.write(mu)
         self.tag_and_layer.write(mu)
         if hasattr(self, "collider"):
@@ -966,88 +1240,403 @@ class MuObject:
             self.camera.write(mu)
         if hasattr(self, "light"):
             self.light.write(mu)
-        for child in self.children:
-            mu.write_int(MuEnum.ET_CHILD_TRANSFORM_START)
-            child.write(mu)
-            mu.write_int(MuEnum.ET_CHILD_TRANSFORM_END)
+
+class MuCache:
+    # A directory of cache files, named by key, kept under max_size bytes by
+    # deleting the least recently used ones. The limit covers every file in
+    # the directory, so caches using different suffixes (parsed models and
+    # decoded textures) share it. Several processes may share the directory:
+    # files are written under a temporary name and then renamed.
+    #
+    # The size of each directory is tracked as files are added, and only
+    # rescanned once over the limit, when it is trimmed to trim_ratio of the
+    # limit to leave room for a while. Other processes' files are seen at
+    # the next scan.
+    sizes = {}
+    trim_ratio = 0.9
+    def __init__(self, path, max_size=1 << 30, suffix=".npz"):
+        self.path = path
+        self.max_size = max_size
+        self.suffix = suffix
+        os.makedirs(path, exist_ok=True)
+        self.directory = os.path.abspath(path)
+    @classmethod
+    def default(cls, suffix=".npz"):
+        # the cache configured through the environment, if any
+        path = os.environ.get("MU_CACHE_DIR")
+        if not path:
+            return None
+        size = os.environ.get("MU_CACHE_SIZE")     # MiB
+        if size:
+            return cls(path, int(size) << 20, suffix)
+        return cls(path, suffix=suffix)
+    def filename(self, key):
+        return os.path.join(self.path, key + self.suffix)
+    def get(self, key):
+        # Returns the path of key's file, or None if it isn't cached.
+        path = self.filename(key)
+        try:
+            # mark it as recently used
+            os.utime(path)
+        except OSError:
+            return None
+        return path
+    def put(self, key, write):
+        # write is called with a binary file to fill in
+        path = self.filename(key)
+        tmp = "%s.%d.tmp" % (path, os.getpid())
+        f = open(tmp, "wb")
+        try:
+            write(f)
+            size = f.tell()
+            f.close()
+            os.replace(tmp, path)
+        except:
+            f.close()
+            os.remove(tmp)
+            raise
+        total = MuCache.sizes.get(self.directory)
+        if total is None or total + size > self.max_size:
+            self.trim()
+        else:
+            MuCache.sizes[self.directory] = total + size
+    def trim(self):
+        entries = []
+        total = 0
+        for name in os.listdir(self.path):
+            if name.endswith(".tmp"):
+                # being written
+                continue
+            path = os.path.join(self.path, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                # removed by someone else
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+        if total > self.max_size:
+            entries.sort()
+            limit = self.max_size * self.trim_ratio
+            for mtime, size, path in entries:
+                if total <= limit:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                total -= size
+        MuCache.sizes[self.directory] = total
+
+# Bump whenever the parsed representation changes so older cache entries
+# are ignored.
+MU_CACHE_VERSION = 2
+
+def cache_classes():
+    # the classes a cached model may be made of
+    return dict((name, cls) for name, cls in globals().items()
+                if isinstance(cls, type) and name.startswith("Mu"))
+
+def encode_state(value, arrays, classes):
+    # Turns a parsed model into something json can store, moving bulk data
+    # to arrays (appended to the list arrays). Only plain values, containers
+    # and the Mu classes (classes, from cache_classes()) are handled:
+    # anything else raises TypeError.
+    if value is None or type(value) in (bool, int, float, str):
+        return value
+    if type(value) is tuple:
+        return {"t": [encode_state(v, arrays, classes) for v in value]}
+    if type(value) is list:
+        for kind, encode in (("r", encode_rows), ("k", encode_keys),
+                             ("w", encode_bone_weights)):
+            data = encode(value)
+            if data is not None:
+                arrays.append(data)
+                return {kind: len(arrays) - 1}
+        return [encode_state(v, arrays, classes) for v in value]
+    if type(value) is dict:
+        for k in value:
+            if type(k) is not str:
+                raise TypeError("dict key %r" % k)
+        return {"d": dict((k, encode_state(v, arrays, classes))
+                          for k, v in value.items())}
+    if isinstance(value, numpy.ndarray):
+        arrays.append(value)
+        return {"n": len(arrays) - 1}
+    if isinstance(value, numpy.generic):
+        return value.item()
+    if type(value) is array:
+        arrays.append(numpy.array(value))
+        return {"aa": len(arrays) - 1, "type": value.typecode}
+    name = type(value).__name__
+    if classes.get(name) is type(value):
+        return {"c": name, "a": dict((k, encode_state(v, arrays, classes))
+                                     for k, v in vars(value).items())}
+    raise TypeError("can't cache %s" % name)
+
+def encode_keys(value):
+    # Returns a list of MuKey objects as read by MuCurve.read as a MuKeys
+    # array, or None if it is something else or wouldn't come back the same.
+    if not value or type(value[0]) is not MuKey:
+        return None
+    rows = []
+    for key in value:
+        if type(key) is not MuKey or len(vars(key)) != 4:
+            return None
+        rows.append((key.time, key.value, key.tangent, key.tangentMode))
+    try:
+        data = numpy.array(rows, MuKeys.dtype)
+    except (TypeError, ValueError, OverflowError):
+        return None
+    if [vars(key) for key in MuKeys(data)] != [vars(key) for key in value]:
+        return None
+    return data
+
+def encode_bone_weights(value):
+    # The same for a list of MuBoneWeight objects, as a MuBoneWeights array
+    if not value or type(value[0]) is not MuBoneWeight:
+        return None
+    rows = []
+    for bw in value:
+        if type(bw) is not MuBoneWeight or len(vars(bw)) != 2:
+            return None
+        rows.append(list(zip(bw.indices, bw.weights)))
+    try:
+        data = numpy.array(rows, MuBoneWeights.dtype)
+    except (TypeError, ValueError, OverflowError):
+        return None
+    if (data.ndim != 2 or data.shape[1] != 4
+            or [vars(bw) for bw in MuBoneWeights(data)]
+               != [vars(bw) for bw in value]):
+        return None
+    return data
+
+def encode_rows(value):
+    # Returns a list of equally long tuples of numbers as a 2d array (of
+    # float32 or int32 when that is exact), or None.
+    if len(value) < 16 or type(value[0]) is not tuple:
+        return None
+    width = len(value[0])
+    kinds = set()
+    for row in value:
+        if type(row) is not tuple or len(row) != width:
+            return None
+        kinds.update(map(type, row))
+    if kinds == set([float]):
+        data = numpy.array(value, numpy.float64)
+        small = data.astype(numpy.float32)
+    elif kinds == set([int]):
+        try:
+            data = numpy.array(value, numpy.int64)
+        except OverflowError:
+            return None
+        small = data.astype(numpy.int32)
+    else:
+        return None
+    if (small == data).all():
+        data = small
+    return data.reshape(len(value), width)
+
+def decode_state(value, arrays, classes, strings):
+    # The inverse of encode_state. arrays(i) returns the i'th array.
+    if type(value) is list:
+        return [decode_state(v, arrays, classes, strings) for v in value]
+    if type(value) is str:
+        # share strings the way Mu.read_string does
+        try:
+            return strings.setdefault(value.encode("latin-1"), value)
+        except UnicodeEncodeError:
+            return value
+    if type(value) is not dict:
+        return value
+    if "t" in value:
+        return tuple(decode_state(v, arrays, classes, strings)
+                     for v in value["t"])
+    if "r" in value:
+        return tuples(arrays(value["r"]))
+    if "k" in value:
+        return MuKeys(arrays(value["k"]))[:]
+    if "w" in value:
+        return MuBoneWeights(arrays(value["w"]))[:]
+    if "d" in value:
+        return dict((k, decode_state(v, arrays, classes, strings))
+                    for k, v in value["d"].items())
+    if "n" in value:
+        return arrays(value["n"])
+    if "aa" in value:
+        data = arrays(value["aa"])
+        return array(value["type"], data.astype(data.dtype.newbyteorder("="))
+                                        .tobytes())
+    cls = classes[value["c"]]
+    obj = cls.__new__(cls)
+    for k, v in value["a"].items():
+        obj.__dict__[k] = decode_state(v, arrays, classes, strings)
+    return obj
+
+def save_state(state):
+    # Returns a function writing a parsed model to a file as .npz: the
+    # arrays, and the rest as json in the "state" array.
+    arrays = []
+    meta = encode_state(state, arrays, cache_classes())
+    meta = json.dumps(meta, separators=(",", ":"))
+    data = dict(("a%d" % i, a) for i, a in enumerate(arrays))
+    data["state"] = numpy.frombuffer(meta.encode(), numpy.uint8)
+    return lambda f: numpy.savez(f, **data)
+
+def load_state(path, strings):
+    # Reads a model saved by save_state. Nothing in the file can make this
+    # run code: no pickles, and only the Mu classes are instantiated.
+    with numpy.load(path, allow_pickle=False) as npz:
+        meta = json.loads(npz["state"].tobytes().decode())
+        return decode_state(meta, lambda i: npz["a%d" % i], cache_classes(),
+                            strings)
+
+def tuples(data):
+    # Returns a 2d array as a list of tuples. None of the tuples can be part
+    # of a cycle, but creating so many of them sets off the garbage
+    # collector over and over.
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return list(map(tuple, data.tolist()))
+    finally:
+        if enabled:
+            gc.enable()
+
+def close_mapping(data):
+    if type(data) == mmap.mmap:
+        try:
+            data.close()
+        except BufferError:
+            # something still holds a view of the mapping: leave it to the
+            # garbage collector
+            pass
+
+_byte = Struct("<B")
+_int = Struct("<i")
+_float = Struct("<f")
 
 class Mu:
 
-    def read_byte(self, count=1, force_list=False):
-        size = 1 * count
-        data = self.file.read(size)
-        if len(data) < size:
+    def unpack(self, fmt, size):
+        pos = self.pos
+        if pos + size > self.size:
+            raise EOFError
+        self.pos = pos + size
+        return unpack_from(fmt, self.data, pos)
+
+    def read_struct(self, st):
+        pos = self.pos
+        if pos + st.size > self.size:
             raise EOFError
-        data = unpack("<%dB" % count, data)
+        self.pos = pos + st.size
+        return st.unpack_from(self.data, pos)
+
+    def read_byte(self, count=1, force_list=False):
         if count == 1 and not force_list:
-            return data[0]
-        return data
+            return self.read_struct(_byte)[0]
+        return self.unpack("<%dB" % count, count)
 
     def read_int(self, count=1, force_list=False):
-        size = 4 * count
-        data = self.file.read(size)
-        if len(data) < size:
-            raise EOFError
-        data = unpack("<%di" % count, data)
         if count == 1 and not force_list:
-            return data[0]
-        return data
+            return self.read_struct(_int)[0]
+        return self.unpack("<%di" % count, 4 * count)
 
     def read_float(self, count=1, force_list=False):
-        size = 4 * count
-        data = self.file.read(size)
-        if len(data) < size:
-            raise EOFError
-        data = unpack("<%df" % count, data)
         if count == 1 and not force_list:
-            return data[0]
-        return data
+            return self.read_struct(_float)[0]
+        return self.unpack("<%df" % count, 4 * count)
 
     def read_vector(self):
-        v = self.read_float(3)
-        #convert from Unity's LHS to Blender's RHS
-        v = v[0], v[2], v[1]
-        return v
+        return swap_vector(self.read_float(3))
 
     def read_quaternion(self):
-        q = self.read_float(4)
-        # Unity is xyzw, blender is wxyz. However, Unity is left-handed and
-        # blender is right handed. To convert between LH and RH (either
-        # direction), just swap y and z and reverse the rotation direction.
-        q = q[3], -q[0], -q[2], -q[1]
-        return q
+        return quat_to_blender(self.read_float(4))
 
     def read_tangent(self):
-        t = self.read_float(4)
-        t = t[0], t[2], t[1], -t[3]
-        return t
+        return swap_tangent(self.read_float(4))
+
+    def read_array(self, type, count, width):
+        # Read count records of width values with a single frombuffer. The
+        # returned array is read-only.
+        dtype = numpy.dtype("<" + type + "4")
+        data = self.read_bytes(count * width * dtype.itemsize)
+        return numpy.frombuffer(data, dtype).reshape(count, width)
+
+    def read_flat(self, type, count):
+        # Read count values into an array.array (a copy of the input).
+        data = array(type)
+        data.frombytes(self.read_bytes(count * data.itemsize))
+        if sys.byteorder == "big":
+            data.byteswap()
+        return data
+
+    def records(self, data):
+        # Return a (count, width) numpy array as a compact MuArray or as a
+        # list of tuples. Compact arrays must not keep the input alive.
+        if self.compact:
+            if not data.flags.owndata:
+                data = data.copy()
+            return MuArray(data, data.shape[1])
+        return tuples(data)
+
+    def read_floats(self, count, width):
+        if self.use_numpy:
+            return self.records(self.read_array("f", count, width))
+        if self.compact:
+            return MuArray(self.read_flat("f", count * width), width)
+        return [self.read_float(width, True) for i in range(count)]
+
+    def read_vectors(self, count):
+        if self.use_numpy:
+            return self.records(self.read_array("f", count, 3)[:, (0, 2, 1)])
+        if self.compact:
+            v = self.read_flat("f", count * 3)
+            v[1::3], v[2::3] = v[2::3], v[1::3]
+            return MuArray(v, 3)
+        return [self.read_vector() for i in range(count)]
+
+    def read_tangents(self, count):
+        if self.use_numpy:
+            t = self.read_array("f", count, 4)[:, (0, 2, 1, 3)]
+            t[:, 3] = -t[:, 3]
+            return self.records(t)
+        if self.compact:
+            t = self.read_flat("f", count * 4)
+            t[1::4], t[2::4] = t[2::4], t[1::4]
+            t[3::4] = array("f", [-w for w in t[3::4]])
+            return MuArray(t, 4)
+        return [self.read_tangent() for i in range(count)]
 
     def read_bytes(self, size):
-        data = self.file.read(size)
-        if len(data) < size:
+        # returns a memoryview slice of the input: no copy is made
+        pos = self.pos
+        if pos + size > self.size:
             raise EOFError
-        return data
+        self.pos = pos + size
+        return self.data[pos:pos + size]
 
     def read_string(self):
         size = self.read_byte()
-        data = self.file.read(size)
-        if len(data) < size:
-            raise EOFError
-        if type(data) == type(""):
-            return data
-        s = ""
-        for c in data:
-            s = s + chr(c)
+        data = self.read_bytes(size).tobytes()
+        # names repeat a lot (curve paths, properties, shader properties):
+        # hand out one shared str per distinct string
+        s = self.strings.get(data)
+        if s is None:
+            # bytes map straight to code points, as they always have
+            s = self.strings[data] = data.decode("latin-1")
         return s
 
     def write_byte(self, data):
         if not hasattr(data, "__len__"):
-            data = (data,)
+            self.file.write(_byte.pack(data))
+            return
         self.file.write(pack(("<%dB" % len(data)), *data))
 
     def write_int(self, data):
         if not hasattr(data, "__len__"):
-            data = (data,)
+            self.file.write(_int.pack(data))
+            return
         self.file.write(pack(("<%di" % len(data)), *data))
 
     def write_uint(self, data):
@@ -1057,24 +1646,59 @@ class Mu:
 
     def write_float(self, data):
         if not hasattr(data, "__len__"):
-            data = (data,)
+            self.file.write(_float.pack(data))
+            return
         self.file.write(pack(("<%df" % len(data)), *data))
 
     def write_vector(self, v):
-        #convert from Blender's RHS to Unity's LHS
-        v = v[0], v[2], v[1]
-        self.write_float(v)
+        self.write_float(swap_vector(v))
 
     def write_quaternion(self, q):
-        # Unity is xyzw, blender is wxyz. However, Unity is left-handed and
-        # blender is right handed. To convert between LH and RH (either
-        # direction), just swap y and z and reverse the rotation direction.
-        q = -q[1], -q[3], -q[2], q[0]
-        self.write_float(q)
+        self.write_float(quat_to_unity(q))
 
     def write_tangent(self, t):
-        t = t[0], t[2], t[1], -t[3]
-        self.write_float(t)
+        self.write_float(swap_tangent(t))
+
+    def write_struct(self, st, data):
+        self.file.write(st.pack(*data))
+
+    # The following write count records of width values in a single call.
+    # Arrays are converted with numpy, sequences (eg, lists of tuples) are
+    # faster to flatten and pack directly.
+    def is_array(self, data):
+        return self.use_numpy and hasattr(data, "__array__")
+
+    def write_floats(self, data, width):
+        if self.is_array(data):
+            data = numpy.asarray(data, "<f4").reshape(-1, width)
+            self.file.write(data.tobytes())
+            return
+        flat = []
+        for d in data:
+            flat.extend(d)
+        self.file.write(pack("<%df" % len(flat), *flat))
+
+    def write_vectors(self, data):
+        #convert from Blender's RHS to Unity's LHS
+        if self.is_array(data):
+            data = numpy.asarray(data, "<f4").reshape(-1, 3)[:, (0, 2, 1)]
+            self.file.write(data.tobytes())
+            return
+        flat = []
+        for v in data:
+            flat += v[0], v[2], v[1]
+        self.file.write(pack("<%df" % len(flat), *flat))
+
+    def write_tangents(self, data):
+        if self.is_array(data):
+            data = numpy.asarray(data, "<f4").reshape(-1, 4)[:, (0, 2, 1, 3)]
+            data[:, 3] = -data[:, 3]
+            self.file.write(data.tobytes())
+            return
+        flat = []
+        for t in data:
+            flat += t[0], t[2], t[1], -t[3]
+        self.file.write(pack("<%df" % len(flat), *flat))
 
     def write_bytes(self, data, size=-1):
         if size == -1:
@@ -1091,30 +1715,180 @@ class Mu:
         self.write_byte(size)
         self.write_bytes(data, size)
 
-    def __init__(self, name = "mu"):
+    def __init__(self, name = "mu", use_numpy=True, strings=None):
         self.name = name
-        pass
-    def read(self, filepath):
+        # pool of strings read so far, keyed by their encoded bytes. Pass
+        # the same dict to several Mu objects to share it across files.
+        self.strings = {} if strings is None else strings
+        # numpy is optional: it only speeds up coding of bulk data
+        self.use_numpy = use_numpy and numpy is not None
+        self.lazy = False
+        self.compact = False
+    def read(self, filepath, lazy=False, compact=False, cache=None):
+        # cache is a MuCache for parsed models (MuCache.default() for the
+        # one set up by MU_CACHE_DIR), if any. It is not used unless given:
+        # with numpy, parsing is about as fast as loading the cached model
+        # (an 8 MB skinned, animated model: 0.01 s compact, 0.5 s otherwise,
+        # either way), so it only pays where the file is slow to read. Lazy
+        # reads don't use the cache, and neither do reads without numpy (it
+        # is needed to store the arrays).
+        data = self.map_file(filepath)
+        try:
+            if cache and not lazy and numpy is not None:
+                return self.read_cached(cache, data, compact)
+            return self.read_buffer(data, lazy, compact)
+        finally:
+            if lazy:
+                # lazily read meshes keep using the mapping until close()
+                self.mapping = data
+            else:
+                close_mapping(data)
+    def close(self):
+        # Release the file kept by a lazy read (or iter_entries). Meshes not
+        # decoded by then can't be decoded any more. Mu objects are context
+        # managers calling close() on exit.
+        data = self.__dict__.pop("data", None)
+        if data is not None:
+            data.release()
+        close_mapping(self.__dict__.pop("mapping", None))
+    def __enter__(self):
+        return self
+    def __exit__(self, *exc):
+        self.close()
+    cached_attrs = ("name", "magic", "version", "obj", "materials",
+                    "textures")
+    def read_cached(self, cache, data, compact):
+        # the key covers the file contents and everything affecting how it
+        # is represented once parsed
+        key = hashlib.sha1()
+        key.update(("%s %d %d %d\n" % (__name__, MU_CACHE_VERSION, compact,
+                                       self.use_numpy)).encode())
+        key.update(data)
+        key = key.hexdigest()
+        path = cache.get(key)
+        if path:
+            try:
+                state = load_state(path, self.strings)
+            except Exception:
+                # damaged or from an incompatible version: parse again
+                state = None
+            if state:
+                self.lazy = False
+                self.compact = compact
+                self.__dict__.update(state)
+                return self
+        if not self.read_buffer(data, False, compact):
+            return None
+        state = dict((a, getattr(self, a)) for a in self.cached_attrs)
+        try:
+            write = save_state(state)
+        except TypeError:
+            # holds something that can't be stored safely: don't cache it
+            return self
+        cache.put(key, write)
+        return self
+    def map_file(self, filepath):
+        f = open(filepath, "rb")
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty files can't be mapped
+            data = f.read()
+        f.close()
+        return data
+    def read_buffer(self, data, lazy=False, compact=False):
+        # data can be any object supporting the buffer protocol (bytes,
+        # bytearray, mmap...). Scalars are decoded with unpack_from at the
+        # current offset and bulk data is sliced out without copying.
+        # With lazy, meshes only record their header and block offsets and
+        # decode their data on first access (the buffer is kept for that).
+        # With compact, mesh vertex data and triangles are kept in MuArrays
+        # rather than lists of tuples.
+        self.start(data, lazy, compact)
+        try:
+            if not self.read_header():
+                return None
+            self.obj = MuObject().read(self)
+            #self.read_materials()
+            #self.read_textures()
+        finally:
+            if not lazy:
+                self.data.release()
+                del self.data
+        return self
+    def start(self, data, lazy, compact):
+        self.lazy = lazy
+        self.compact = compact
         self.materials = []
         self.textures = []
-        self.file = open(filepath, "rb")
+        self.data = memoryview(data)
+        self.size = len(self.data)
+        self.pos = 0
+    def read_header(self):
         self.magic, self.version = self.read_int(2)
         if (self.magic != MuEnum.MODEL_BINARY or self.version < 0
             or self.version > MuEnum.FILE_VERSION):
-            return None
+            return False
         self.name = self.read_string()
         #print("version: %d '%s'" % (self.version, self.name))
-        self.obj = MuObject().read(self)
-        #self.read_materials()
-        #self.read_textures()
-        del self.file
-        return self
+        return True
+    def iter_entries(self, filepath, compact=False):
+        # Walk the file without building the object tree, yielding
+        # (depth, path, entry_type, payload) for each entry as it is read.
+        # path is the "/" separated names of the transforms from the root.
+        # Each transform starts with ET_CHILD_TRANSFORM_START with its
+        # MuTransform as payload and finishes with ET_CHILD_TRANSFORM_END
+        # with None (the root transform included). Component payloads are
+        # what MuObject would hold, ET_MATERIALS and ET_TEXTURES give lists.
+        # Meshes are read lazily, so only the entry being handled is held
+        # in memory (the file stays mapped while any mesh refers to it).
+        # Unknown entry types are yielded with a None payload.
+        self.mapping = self.map_file(filepath)
+        self.start(self.mapping, True, compact)
+        if not self.read_header():
+            return
+        names = []
+        entry_type = MuEnum.ET_CHILD_TRANSFORM_START
+        while True:
+            if entry_type == MuEnum.ET_CHILD_TRANSFORM_START:
+                transform = MuTransform().read(self)
+                names.append(transform.name)
+                payload = transform
+            elif entry_type == MuEnum.ET_CHILD_TRANSFORM_END:
+                payload = None
+            else:
+                payload = read_entry(self, entry_type)[1]
+            yield len(names) - 1, "/".join(names), entry_type, payload
+            if entry_type == MuEnum.ET_CHILD_TRANSFORM_END:
+                names.pop()
+                if not names:
+                    return
+            try:
+                entry_type = self.read_int()
+            except EOFError:
+                # the root (at least) has no end marker
+                entry_type = MuEnum.ET_CHILD_TRANSFORM_END
     def write(self, filepath):
-        self.file = open(filepath, "wb")
+        # encode everything first so the file is written in one go
+        data = self.write_buffer()
+        f = open(filepath, "wb")
+        f.write(data)
+        f.close()
+    def write_buffer(self):
+        # returns the encoded .mu file as a bytes-like object
+        self.file = BytesIO()
+        self.write_header()
+        self.obj.write(self)
+        self.write_materials()
+        data = self.file.getbuffer()
+        del self.file
+        return data
+    def write_header(self):
         self.write_int(MuEnum.MODEL_BINARY)
         self.write_int(MuEnum.FILE_VERSION)
         self.write_string(self.name)
-        self.obj.write(self)
+    def write_materials(self):
+        # materials and textures follow the root object's children
         if len(self.materials):
             self.write_int(MuEnum.ET_MATERIALS)
             self.write_int(len(self.materials))
@@ -1125,9 +1899,163 @@ class Mu:
             self.write_int(len(self.textures))
             for tex in self.textures:
                 tex.write(self)
-        del self.file
+
+class MuWriter(Mu):
+    # Writes a .mu file while the caller walks its hierarchy, so only the
+    # object being written needs to be held in memory:
+    #   begin_object(root) ... end_object()
+    # with each child's begin_object/end_object pair nested in between. The
+    # objects passed to begin_object need no children; any present are
+    # ignored. Set materials and textures before calling close(), which
+    # writes them and completes the file. The file is written under a
+    # temporary name until then, so abort() leaves any existing file
+    # untouched.
+    def __init__(self, filepath, name="mu", use_numpy=True):
+        Mu.__init__(self, name, use_numpy)
+        self.materials = []
+        self.textures = []
+        self.filepath = filepath
+        self.file = open(filepath + ".part", "wb")
+        self.depth = 0
+        self.write_header()
+    def begin_object(self, obj):
+        if self.depth:
+            self.write_int(MuEnum.ET_CHILD_TRANSFORM_START)
+        obj.write_components(self)
+        self.depth += 1
+    def end_object(self):
+        self.depth -= 1
+        if self.depth:
+            self.write_int(MuEnum.ET_CHILD_TRANSFORM_END)
+    def close(self):
+        if self.depth:
+            raise ValueError("MuWriter: %d objects not ended" % self.depth)
+        self.write_materials()
+        self.file.close()
+        os.replace(self.filepath + ".part", self.filepath)
+    def abort(self):
+        self.file.close()
+        os.remove(self.filepath + ".part")
+
+def find_files(paths, exts):
+    # Expands directories (recursively) and glob patterns into the files
+    # with the given extensions, yielding (path, name): name is relative to
+    # the directory given, or to the directory a glob starts from. Files
+    # named explicitly are kept whatever their extension.
+    for path in paths:
+        if os.path.isdir(path):
+            for f in walk_files(path, exts):
+                yield f, os.path.relpath(f, path)
+            continue
+        if not glob.has_magic(path):
+            # let the caller report it if it isn't a file
+            yield path, os.path.basename(path)
+            continue
+        matches = sorted(glob.glob(path, recursive=True))
+        if not matches:
+            # let the caller report it
+            yield path, os.path.basename(path)
+            continue
+        top = glob_root(path)
+        seen = set()
+        for match in matches:
+            if os.path.isdir(match):
+                found = walk_files(match, exts)
+            elif match.lower().endswith(exts):
+                found = [match]
+            else:
+                continue
+            for f in found:
+                # ** matches both directories and the files in them
+                if f not in seen:
+                    seen.add(f)
+                    yield f, os.path.relpath(f, top)
+
+def walk_files(directory, exts):
+    # the files under directory with the given extensions, in sorted order
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for f in sorted(files):
+            if f.lower().endswith(exts):
+                yield os.path.join(root, f)
+
+def glob_root(pattern):
+    # the directory a glob pattern starts from: its leading components
+    # without wildcards
+    head = os.path.dirname(pattern)
+    while glob.has_magic(head):
+        head = os.path.dirname(head)
+    return head or os.curdir
+
+def find_mu_files(paths):
+    for path, name in find_files(paths, ".mu"):
+        yield path
+
+def run_batch(func, items, jobs, time_key, chunksize=1):
+    # The batch mode of the scripts: runs func over items across jobs worker
+    # processes, printing the reports it returns (dicts with at least ok,
+    # bytes and time) as NDJSON in order, then a summary line with the
+    # totals (the time spent in func as time_key). Returns the exit status.
+    from concurrent.futures import ProcessPoolExecutor
+
+    summary = {"summary": True, "files": len(items), "ok": 0, "failed": 0,
+               "bytes": 0, time_key: 0.0}
+    start = time.perf_counter()
+    if jobs > 1 and len(items) > 1:
+        executor = ProcessPoolExecutor(jobs)
+        results = executor.map(func, items, chunksize=chunksize)
+    else:
+        executor = None
+        results = map(func, items)
+    try:
+        for result in results:
+            summary["ok" if result["ok"] else "failed"] += 1
+            summary["bytes"] += result["bytes"]
+            summary[time_key] += result["time"]
+            print(json.dumps(result))
+    finally:
+        if executor:
+            executor.shutdown()
+    summary["time"] = time.perf_counter() - start
+    print(json.dumps(summary))
+    return 1 if summary["failed"] else 0
+
+def parse_file(path):
+    # Parse a .mu file completely and return a report on how it went.
+    result = {"path": path, "ok": False, "bytes": 0}
+    start = time.perf_counter()
+    try:
+        result["bytes"] = os.path.getsize(path)
+        mu = Mu()
+        if mu.read(path, compact=True, cache=False):
+            result["ok"] = True
+        else:
+            result["error"] = "unrecognized format"
+    except Exception as e:
+        result["error"] = type(e).__name__
+        if str(e):
+            result["error"] += ": " + str(e)
+    result["time"] = time.perf_counter() - start
+    return result
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Parse .mu files and "
+                                     "report the results as NDJSON")
+    parser.add_argument("paths",
+                        nargs="+",
+                        metavar="FILE|DIR|GLOB",
+                        help=".mu files, directories to search or globs")
+    parser.add_argument("-j",
+                        "--jobs",
+                        type=int,
+                        default=os.cpu_count() or 1,
+                        help="Number of worker processes")
+    args = parser.parse_args()
+
+    files = list(find_mu_files(args.paths))
+    return run_batch(parse_file, files, args.jobs, "parse_time", 4)
 
 if __name__ == "__main__":
-    mu = Mu()
-    mu.read("model.mu")
-    #mu.write("write.mu")
+    sys.exit(main())
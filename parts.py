@@ -0,0 +1,318 @@
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from .cfgnode import ConfigNode
+
+
+def get_extension(filepath):
+    ''' returns the extention of the file, without the dot'''
+    ext = os.path.splitext(filepath)[-1]
+    return ext[1:]
+
+
+def read_cfg_file(filepath):
+    ''' reads the fields of a part.cfg file '''
+    with open(filepath, 'r') as partcfg:
+        try:
+            partcfg_data = partcfg.read()
+            cfgnode = ConfigNode.load(partcfg_data)
+            return cfgnode
+        except UnicodeDecodeError:
+            print('Bad encoding found while loading part.cfg')
+            return None
+
+
+def parse_cfg_node(cfgnode, cfgpath, root, files, parts_files):
+    ''' Reads the cfg nodes and get the part data'''
+    # The cfg is a PART node containing all the data
+    # See http://wiki.kerbalspaceprogram.com/wiki/CFG_File_Documentation
+    partname = ""
+    meshpath = None
+    rescalefactor = None
+    scale = None
+    # The mesh can be defined by a MODEL node -> parsing nodes
+    # if cfgnode.nodes[0[1].nodes is not None:
+    if cfgnode.nodes[0][1] is not None:
+        for node in cfgnode.nodes[0][1].nodes:
+            if node[0] == 'MODEL':
+                for label, value in node[1].values:
+                    if label == 'model':
+                        candidate = os.path.join(cfgpath, os.path.basename(value) + '.mu')
+                        if os.path.isfile(candidate):
+                            meshpath = candidate
+                    if label == 'scale':
+                        scale = value
+                if not meshpath:
+                    print('The corresponding mu file "{}" is not found. Looking for mesh field'.format(candidate))
+
+    # The mesh can also be defined by 'mesh' token. Also retrieving relevant part data
+    for label, value in cfgnode.nodes[0][1].values:
+        if label == 'name':
+            partname = value.strip().replace('.', '_')
+        if meshpath is None and label == 'mesh':
+            mupath = os.path.join(cfgpath, value)
+            if not os.path.isfile(mupath) or not get_extension(value) == 'mu':
+                print('Warning: [CraftReader::parse_cfg_node] The model for {} doesn''t exist or is not \
+                       a mu file (not supported). Looking for substitution mu file'.format(partname))
+                for f in files:
+                    if f.endswith('mu'):
+                        print('Warning: [CraftReader::parse_cfg_node] a substitution mu file was used. \
+                               The result may be altered')
+                        meshpath = os.path.join(root, f)
+            else:
+                meshpath = mupath
+        if label == 'rescaleFactor':
+            rescalefactor = value
+    if meshpath:
+        parts_files[partname] = dict()
+        parts_files[partname]['mu'] = meshpath
+        if rescalefactor:
+            parts_files[partname]['rescaleFactor'] = rescalefactor
+        if scale:
+            parts_files[partname]['scale'] = scale
+
+
+def walk_cfg_files(directory):
+    ''' yields (cfg path, directory, files in the directory) for every
+    .cfg file, in os.walk order '''
+    for root, dirs, files in os.walk(directory):
+        for name in files:
+            if get_extension(name) == 'cfg':
+                yield os.path.join(root, name), root, files
+
+
+def parse_cfg_file(item):
+    ''' parts_files for a single cfg, item being what walk_cfg_files yields '''
+    cfg_file_path, root, files = item
+    parts_files = dict()
+    cfgnode = read_cfg_file(cfg_file_path)
+    if cfgnode is not None:
+        # path in cfg files are incomplete, so we need to join the full path of the cfg file
+        cfg_directory = os.path.split(cfg_file_path)[0]
+        parse_cfg_node(cfgnode, cfg_directory, root, files, parts_files)
+    return parts_files
+
+
+def parse_cfg_files(items, jobs=1):
+    ''' parse_cfg_file for every item, spread over jobs processes. The
+    results are in the same order as the items. '''
+    if jobs > 1 and len(items) > 1:
+        chunksize = max(1, len(items) // (jobs * 8))
+        with ProcessPoolExecutor(jobs) as executor:
+            return list(executor.map(parse_cfg_file, items,
+                                     chunksize=chunksize))
+    return [parse_cfg_file(item) for item in items]
+
+
+def default_jobs():
+    return int(os.environ.get('MU_PART_JOBS', 1))
+
+
+def check_parts_in_directory(directory, catalog=None, jobs=None):
+    ''' Scan the directory for parts (pairs of .cfg and .mu files)
+
+    catalog is a PartCatalog remembering earlier scans, by default the one
+    named by the MU_PART_CATALOG environment variable (if set). The .cfg
+    files are parsed by jobs worker processes (MU_PART_JOBS, 1 by default). '''
+    if catalog is None:
+        catalog = PartCatalog.default()
+        try:
+            return check_parts_in_directory(directory, catalog, jobs)
+        finally:
+            if catalog:
+                catalog.close()
+    if jobs is None:
+        jobs = default_jobs()
+    if catalog:
+        return catalog.scan(directory, jobs)
+    parts_files = dict()
+    # merge in walk order so later cfgs win, whichever worker parsed them
+    for part in parse_cfg_files(list(walk_cfg_files(directory)), jobs):
+        parts_files.update(part)
+    return parts_files
+
+
+def find_parts(directory, catalog, jobs=None):
+    ''' parts_files for the directory, for looking up the parts a craft
+    uses. With a catalog, parts are resolved through it one by one instead
+    of scanning the whole directory first (see CatalogParts): the catalog
+    must stay open while the result is used. '''
+    if not catalog:
+        return check_parts_in_directory(directory, False, jobs)
+    if jobs is None:
+        jobs = default_jobs()
+    return CatalogParts(catalog, directory, jobs)
+
+
+class PartCatalog(object):
+    ''' SQLite index of the parts found by check_parts_in_directory
+
+    Every .cfg file is stored with its size and mtime, those of its
+    directory (the .mu files it refers to live there) and the part it
+    defines, if any. Rescanning only parses the .cfg files that changed. '''
+    schema = '''
+        CREATE TABLE IF NOT EXISTS cfgs (
+            directory TEXT NOT NULL,    -- the scanned directory
+            path TEXT NOT NULL,
+            seq INTEGER NOT NULL,       -- position in the walk
+            mtime INTEGER NOT NULL,
+            size INTEGER NOT NULL,
+            dir_mtime INTEGER NOT NULL,
+            name TEXT,                  -- NULL if the cfg defines no part
+            mu TEXT,
+            rescaleFactor TEXT,
+            scale TEXT,
+            PRIMARY KEY (directory, path)
+        );
+        CREATE INDEX IF NOT EXISTS cfgs_name ON cfgs (directory, name);
+    '''
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.db.executescript(self.schema)
+
+    @classmethod
+    def default(cls):
+        path = os.environ.get('MU_PART_CATALOG')
+        if not path:
+            return None
+        return cls(path)
+
+    def close(self):
+        self.db.close()
+
+    def scan(self, directory, jobs=1):
+        ''' Brings the catalog up to date with the directory and returns
+        the same parts_files as an uncached scan. Changed .cfg files are
+        parsed by jobs worker processes. '''
+        known = dict()
+        for row in self.db.execute('''SELECT path, seq, mtime, size,
+                                          dir_mtime, name, mu,
+                                          rescaleFactor, scale
+                                   FROM cfgs WHERE directory = ?''',
+                                   (directory,)):
+            known[row[0]] = row[1:]
+        cfgs = []
+        changed = []
+        dir_mtimes = dict()
+        for item in walk_cfg_files(directory):
+            path, root, files = item
+            if root not in dir_mtimes:
+                dir_mtimes[root] = os.stat(root).st_mtime_ns
+            st = os.stat(path)
+            stamp = (st.st_mtime_ns, st.st_size, dir_mtimes[root])
+            row = known.pop(path, None)
+            if row is not None and tuple(row[1:4]) == stamp:
+                part = row[4:]
+                seq = row[0]
+            else:
+                part = None
+                seq = None
+                changed.append(item)
+            cfgs.append((path, stamp, part, seq))
+        parsed = iter(parse_cfg_files(changed, jobs))
+        parts_files = dict()
+        with self.db:
+            for seq, (path, stamp, part, old_seq) in enumerate(cfgs):
+                if part is None:
+                    part = self.part_row(next(parsed))
+                if seq != old_seq:
+                    # only rows that are new, changed or moved in the walk
+                    self.db.execute('''INSERT OR REPLACE INTO cfgs
+                                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                                    (directory, path, seq) + stamp
+                                    + tuple(part))
+                if part[0] is not None:
+                    # later cfgs win, as in the uncached scan
+                    parts_files[part[0]] = self.part_entry(part)
+            for path in known:
+                self.db.execute('''DELETE FROM cfgs
+                                   WHERE directory = ? AND path = ?''',
+                                (directory, path))
+        return parts_files
+
+    def part_row(self, parts_files):
+        ''' (name, mu, rescaleFactor, scale) of the part parsed from a
+        cfg, all None if there isn't one '''
+        for name, part in parts_files.items():
+            return (name, part['mu'], part.get('rescaleFactor'),
+                    part.get('scale'))
+        return (None, None, None, None)
+
+    def part_entry(self, part):
+        entry = dict()
+        entry['mu'] = part[1]
+        if part[2]:
+            entry['rescaleFactor'] = part[2]
+        if part[3]:
+            entry['scale'] = part[3]
+        return entry
+
+    def lookup(self, directory, name):
+        ''' The parts_files entry for the named part as of the last scan
+        of directory, or None if it wasn't found then or its .cfg file
+        (or the directory holding it) has changed since '''
+        row = self.db.execute('''SELECT path, mtime, size, dir_mtime,
+                                        name, mu, rescaleFactor, scale
+                                 FROM cfgs WHERE directory = ? AND name = ?
+                                 ORDER BY seq DESC LIMIT 1''',
+                              (directory, name)).fetchone()
+        if row is None:
+            return None
+        path = row[0]
+        try:
+            st = os.stat(path)
+            dir_mtime = os.stat(os.path.dirname(path)).st_mtime_ns
+        except OSError:
+            return None
+        if (st.st_mtime_ns, st.st_size, dir_mtime) != tuple(row[1:4]):
+            return None
+        return self.part_entry(row[4:])
+
+    def count(self, directory):
+        ''' The number of parts found by the last scan of directory '''
+        return self.db.execute('''SELECT COUNT(DISTINCT name) FROM cfgs
+                                  WHERE directory = ?''',
+                               (directory,)).fetchone()[0]
+
+
+class CatalogParts(object):
+    ''' The parts_files of a directory, resolved through a PartCatalog
+
+    Parts are looked up as they are asked for, only checking their own
+    .cfg file is unchanged. The directory is scanned (bringing the catalog
+    up to date) the first time a part is missing or out of date. Parts
+    newly defined elsewhere under a name the catalog already knows are
+    only noticed by such a scan. '''
+
+    def __init__(self, catalog, directory, jobs=1):
+        self.catalog = catalog
+        self.directory = directory
+        self.jobs = jobs
+        self.parts = dict()
+        self.scanned = None
+
+    def get(self, name, default=None):
+        if self.scanned is None and name not in self.parts:
+            part = self.catalog.lookup(self.directory, name)
+            if part is None:
+                self.scanned = self.catalog.scan(self.directory, self.jobs)
+            else:
+                self.parts[name] = part
+        if self.scanned is not None:
+            return self.scanned.get(name, default)
+        return self.parts[name]
+
+    def __contains__(self, name):
+        return self.get(name) is not None
+
+    def __getitem__(self, name):
+        part = self.get(name)
+        if part is None:
+            raise KeyError(name)
+        return part
+
+    def __len__(self):
+        if self.scanned is not None:
+            return len(self.scanned)
+        return self.catalog.count(self.directory)
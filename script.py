@@ -19,6 +19,8 @@
 
 # <pep8 compliant>
 
+import re
+
 class ScriptError(Exception):
     def __init__(self, fname, line, message):
         Exception.__init__(self, "%s:%d: %s" % (fname, line, message))
@@ -114,3 +116,78 @@ class Script:
         return self.token
     def ungetToken(self):
         self.unget = True
+
+# everything skipped before a token: whitespace, end of file characters and
+# // comments, staying on the current line or not
+_skip = re.compile(r"(?:[^\S\n]|[\x1a\x04])*(?://[^\n]*)?")
+_skip_nl = re.compile(r"(?:\s|[\x1a\x04]|//[^\n]*)*")
+# the rest of the line, up to a newline or a // comment
+_line = re.compile(r"[^\n/]*(?:/(?!/)[^\n/]*)*")
+
+class FastScript(Script):
+    # Script with the scanning done by regular expressions and str methods
+    # instead of a character at a time. Tokens, line counts and errors are
+    # the same, except that EOF inside a quoted string is reported through
+    # error() rather than as an IndexError.
+    def __init__(self, filename, text, single="{}()':"):
+        Script.__init__(self, filename, text, single)
+        # position of the token tokenAvailable last found
+        self.ready = -1
+        self.word = re.compile(r"[^\s%s]+" % re.escape(single))
+    def tokenAvailable(self, crossline=False):
+        if self.unget:
+            return True
+        text = self.text
+        pos = self.pos
+        if crossline:
+            self.pos = _skip_nl.match(text, pos).end()
+            self.line += text.count("\n", pos, self.pos)
+        else:
+            self.pos = _skip.match(text, pos).end()
+        if self.pos < len(text) and text[self.pos] != "\n":
+            # getToken needn't look again
+            self.ready = self.pos
+            return True
+        return False
+    def getLine(self):
+        text = self.text
+        start = self.pos
+        end = _line.match(text, start).end()
+        self.pos = end
+        if end < len(text) and text[end] == "\n":
+            self.line += 1
+            self.pos += 1
+        if self.unget:
+            self.unget = False
+            self.token = self.token + text[start:end]
+        else:
+            self.token = text[start:end]
+        return self.pos < len(text)
+    def getToken(self, crossline=False):
+        if self.unget:
+            self.unget = False
+            return self.token
+        if self.pos != self.ready and not self.tokenAvailable(crossline):
+            if not crossline:
+                self.error("line is incomplete")
+            return None
+        text = self.text
+        pos = self.pos
+        if text[pos] == "\"":
+            start = pos + 1
+            pos = text.find("\"", start)
+            if pos < 0:
+                self.line += text.count("\n", start)
+                self.pos = len(text)
+                self.error("EOF inside quoted string")
+                return None
+            self.line += text.count("\n", start, pos)
+            self.token = text[start:pos]
+            self.pos = pos + 1
+        elif text[pos] in self.single:
+            self.token = text[pos]
+            self.pos = pos + 1
+        else:
+            self.pos = self.word.match(text, pos).end()
+            self.token = text[pos:self.pos]
+        return self.token
@@ -0,0 +1,409 @@
+# vim:ts=4:et
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# <pep8 compliant>
+
+# Decodes KSP's MBM and DDS textures without blender, converting them the
+# same way the importer does, and writes them as PNG. Pixels are RGBA bytes
+# with the rows from the bottom up, as in blender's Image.pixels. numpy is
+# needed for DDS files.
+
+import os
+import sys
+import time
+import zlib
+from math import sqrt
+from struct import pack, unpack, unpack_from
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    from .mu import find_files, run_batch
+except ImportError:
+    # run as a script
+    from mu import find_files, run_batch
+
+MBM_MAGIC = 0x50534b03  # "\x03KSP" as little endian
+
+DDS_MAGIC = b"DDS "
+DDPF_ALPHAPIXELS = 0x1
+DDPF_FOURCC = 0x4
+DDPF_RGB = 0x40
+DDPF_LUMINANCE = 0x20000
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+class TextureError(Exception):
+    pass
+
+def is_bump_dds(name):
+    return name[-6:-4] == "_n"
+
+def convert_bump(pixels, width, height, reconstruct_z=False):
+    # Converts a KSP normal map (x in alpha, z in blue) to a blender one,
+    # leaving the border pixels alone. pixels holds either bytes or
+    # normalized floats. A numpy array is converted in place, anything else
+    # is copied to a list. Z is left at full scale unless reconstruct_z.
+    if numpy and isinstance(pixels, numpy.ndarray):
+        full = 255 if pixels.dtype.kind in "iu" else 1.0
+        p = pixels.reshape(height, width, 4)[1:-1, 1:-1]
+        if reconstruct_z:
+            nx = (p[..., 3] * (255.0 / full) - 128) / 127.
+            nz = (p[..., 2] * (255.0 / full) - 128) / 127.
+            z = numpy.sqrt(numpy.maximum(1 - nx * nx - nz * nz, 0))
+            z = (z * 127 + 128) * (full / 255.0)
+        p[..., 0] = p[..., 3]
+        p[..., 1] = p[..., 2]
+        p[..., 2] = z if reconstruct_z else full
+        p[..., 3] = full
+        return pixels
+    outp = list(pixels)
+    full = 255 if isinstance(outp[0], int) else 1.0
+    for y in range(1, height - 1):
+        for x in range(1, width - 1):
+            index = (y * width + x) * 4
+            p = outp[index:index + 4]
+            z = full
+            if reconstruct_z:
+                nx = (p[3] * (255.0 / full) - 128) / 127.
+                nz = (p[2] * (255.0 / full) - 128) / 127.
+                z = sqrt(max(1 - nx * nx - nz * nz, 0)) * 127 + 128
+                z = z * (full / 255.0)
+                if full == 255:
+                    z = int(z)
+            outp[index:index + 4] = [p[3], p[2], z, full]
+    return outp
+
+def read_mbm(mbmdata, reconstruct_z=False):
+    # Returns (width, height, pixels) with pixels a flat uint8 array (a list
+    # without numpy). MBM rows are already stored from the bottom up.
+    if len(mbmdata) < 20:
+        raise TextureError("truncated MBM header")
+    magic, width, height, bump, bpp = unpack("<5i", mbmdata[:20])
+    if magic != MBM_MAGIC:
+        raise TextureError("not an MBM file")
+    if bpp not in (24, 32):
+        raise TextureError("unsupported MBM depth %d" % bpp)
+    size = width * height * bpp // 8
+    data = mbmdata[20:20 + size]
+    if len(data) < size:
+        raise TextureError("truncated MBM pixels")
+    if numpy:
+        pixels = numpy.frombuffer(data, numpy.uint8)
+        if bpp == 24:
+            rgb = pixels.reshape(-1, 3)
+            pixels = numpy.empty((len(rgb), 4), numpy.uint8)
+            pixels[:, :3] = rgb
+            pixels[:, 3] = 255
+            pixels = pixels.reshape(-1)
+        if bump:
+            if not pixels.flags.writeable:
+                pixels = pixels.copy()
+            convert_bump(pixels, width, height, reconstruct_z)
+    else:
+        if bpp == 24:
+            rgb = data
+            data = bytearray(b"\xff") * (width * height * 4)
+            for i in range(3):
+                data[i::4] = rgb[i::3]
+        pixels = list(data)
+        if bump:
+            pixels = convert_bump(pixels, width, height, reconstruct_z)
+    return width, height, pixels
+
+def decode_mbm(mbmdata):
+    # Returns the pixels as normalized floats, ready for Image.pixels
+    width, height, pixels = read_mbm(mbmdata)
+    if numpy:
+        pixels = pixels.astype(numpy.float32) / 255
+    else:
+        scale = [i / 255.0 for i in range(256)]
+        pixels = [scale[x] for x in pixels]
+    return width, height, pixels
+
+def decode_dds(ddsdata, bump=False):
+    # Returns the pixels as normalized floats, ready for Image.pixels: the
+    # same as blender loading the file and the importer flipping it (and
+    # converting it if bump)
+    width, height, pixels = read_dds(ddsdata)
+    if bump:
+        convert_bump(pixels, width, height)
+    return width, height, pixels.astype(numpy.float32) / 255
+
+def load_mbm(mbmpath):
+    with open(mbmpath, "rb") as mbmfile:
+        return decode_mbm(mbmfile.read())
+
+def rgb565(c):
+    # expands 5:6:5 colors to (..., 3) 8 bit channels, as ints
+    c = c.astype(numpy.int32)
+    r = (c >> 11) & 31
+    g = (c >> 5) & 63
+    b = c & 31
+    return numpy.stack([(r << 3) | (r >> 2), (g << 2) | (g >> 4),
+                        (b << 3) | (b >> 2)], -1)
+
+def dxt_colors(blocks, dxt1):
+    # Decodes the (n, 8) color halves of DXT blocks to (n, 16, 4) RGBA.
+    # Only DXT1 has the 3 color mode with transparent black.
+    blocks = numpy.ascontiguousarray(blocks)
+    n = len(blocks)
+    c = blocks.view("<u2")
+    p0 = rgb565(c[:, 0])
+    p1 = rgb565(c[:, 1])
+    palette = numpy.empty((n, 4, 4), numpy.int32)
+    palette[:, 0, :3] = p0
+    palette[:, 1, :3] = p1
+    palette[:, 2, :3] = (2 * p0 + p1) // 3
+    palette[:, 3, :3] = (p0 + 2 * p1) // 3
+    palette[:, :, 3] = 255
+    if dxt1:
+        three = c[:, 0] <= c[:, 1]
+        palette[three, 2, :3] = (p0[three] + p1[three]) // 2
+        palette[three, 3] = 0
+    bits = c[:, 2].astype(numpy.uint32) | (c[:, 3].astype(numpy.uint32) << 16)
+    shifts = numpy.arange(0, 32, 2, dtype=numpy.uint32)
+    index = (bits[:, None] >> shifts) & 3
+    return palette[numpy.arange(n)[:, None], index].astype(numpy.uint8)
+
+def dxt3_alpha(blocks):
+    # (n, 8) explicit 4 bit alphas to (n, 16)
+    bits = numpy.ascontiguousarray(blocks).view("<u8")
+    shifts = numpy.arange(0, 64, 4, dtype=numpy.uint64)
+    return (((bits >> shifts) & 15) * 17).astype(numpy.uint8)
+
+def dxt5_alpha(blocks):
+    # (n, 8) interpolated alphas to (n, 16)
+    n = len(blocks)
+    a0 = blocks[:, 0].astype(numpy.int32)
+    a1 = blocks[:, 1].astype(numpy.int32)
+    palette = numpy.empty((n, 8), numpy.int32)
+    palette[:, 0] = a0
+    palette[:, 1] = a1
+    eight = a0 > a1
+    for i in range(1, 7):
+        palette[:, i + 1] = ((7 - i) * a0 + i * a1) // 7
+    six = ~eight
+    for i in range(1, 5):
+        palette[six, i + 1] = ((5 - i) * a0[six] + i * a1[six]) // 5
+    palette[six, 6] = 0
+    palette[six, 7] = 255
+    bits = numpy.zeros((n, 8), numpy.uint8)
+    bits[:, :6] = blocks[:, 2:]
+    bits = bits.view("<u8")
+    shifts = numpy.arange(0, 48, 3, dtype=numpy.uint64)
+    index = ((bits >> shifts) & 7).astype(numpy.intp)
+    return palette[numpy.arange(n)[:, None], index].astype(numpy.uint8)
+
+def decode_dxt(data, width, height, fourcc):
+    bw = (width + 3) // 4
+    bh = (height + 3) // 4
+    size = 8 if fourcc == b"DXT1" else 16
+    count = bw * bh
+    if len(data) < 128 + count * size:
+        raise TextureError("truncated DDS pixels")
+    blocks = numpy.frombuffer(data, numpy.uint8, count * size, 128)
+    blocks = blocks.reshape(count, size)
+    if fourcc == b"DXT1":
+        pixels = dxt_colors(blocks, True)
+    else:
+        pixels = dxt_colors(blocks[:, 8:], False)
+        if fourcc == b"DXT5":
+            pixels[:, :, 3] = dxt5_alpha(blocks[:, :8])
+        else:
+            pixels[:, :, 3] = dxt3_alpha(blocks[:, :8])
+    # blocks of 4x4 pixels to rows, cropped to the image size
+    pixels = pixels.reshape(bh, bw, 4, 4, 4).transpose(0, 2, 1, 3, 4)
+    pixels = pixels.reshape(bh * 4, bw * 4, 4)[:height, :width]
+    return numpy.ascontiguousarray(pixels).reshape(-1)
+
+def mask_channel(values, mask):
+    # extracts the masked bits, scaled to 8 bits
+    if not mask:
+        return 0
+    shift = (mask & -mask).bit_length() - 1
+    top = mask >> shift
+    c = (values & mask) >> shift
+    if top != 255:
+        c = (c * 255 + top // 2) // top
+    return c
+
+def decode_rgb(data, width, height, flags, bits, masks):
+    if bits not in (8, 16, 24, 32):
+        raise TextureError("unsupported DDS depth %d" % bits)
+    size = bits // 8
+    count = width * height
+    if len(data) < 128 + count * size:
+        raise TextureError("truncated DDS pixels")
+    raw = numpy.frombuffer(data, numpy.uint8, count * size, 128)
+    values = numpy.zeros((count, 4), numpy.uint8)
+    values[:, :size] = raw.reshape(count, size)
+    values = values.view("<u4")[:, 0].astype(numpy.int64)
+    rmask, gmask, bmask, amask = masks
+    pixels = numpy.empty((count, 4), numpy.uint8)
+    pixels[:, 0] = mask_channel(values, rmask)
+    if flags & DDPF_LUMINANCE:
+        pixels[:, 1] = pixels[:, 2] = pixels[:, 0]
+    else:
+        pixels[:, 1] = mask_channel(values, gmask)
+        pixels[:, 2] = mask_channel(values, bmask)
+    if flags & DDPF_ALPHAPIXELS and amask:
+        pixels[:, 3] = mask_channel(values, amask)
+    else:
+        pixels[:, 3] = 255
+    return pixels.reshape(-1)
+
+def read_dds(ddsdata):
+    # Returns (width, height, pixels) with pixels a flat uint8 array. Only
+    # the top mipmap is decoded. KSP stores its DDS textures upside down, so
+    # the rows come out from the bottom up without flipping (blender loads
+    # them the other way round and the importer flips them back).
+    if numpy is None:
+        raise TextureError("numpy is needed to read DDS files")
+    if len(ddsdata) < 128 or ddsdata[:4] != DDS_MAGIC:
+        raise TextureError("not a DDS file")
+    height, width = unpack_from("<2I", ddsdata, 12)
+    flags, fourcc, bits = unpack_from("<I4sI", ddsdata, 80)
+    masks = unpack_from("<4I", ddsdata, 92)
+    if flags & DDPF_FOURCC:
+        if fourcc not in (b"DXT1", b"DXT3", b"DXT5"):
+            raise TextureError("unsupported DDS format %s"
+                               % fourcc.decode("latin-1"))
+        pixels = decode_dxt(ddsdata, width, height, fourcc)
+    elif flags & (DDPF_RGB | DDPF_LUMINANCE):
+        pixels = decode_rgb(ddsdata, width, height, flags, bits, masks)
+    else:
+        raise TextureError("unsupported DDS pixel format %#x" % flags)
+    return width, height, pixels
+
+def read_texture(path, reconstruct_z=False):
+    # Reads an MBM or DDS file, converted the way the importer does it
+    with open(path, "rb") as f:
+        data = f.read()
+    ext = path[-4:].lower()
+    if ext == ".mbm":
+        return read_mbm(data, reconstruct_z)
+    if ext == ".dds":
+        width, height, pixels = read_dds(data)
+        if is_bump_dds(os.path.basename(path)):
+            convert_bump(pixels, width, height, reconstruct_z)
+        return width, height, pixels
+    raise TextureError("unsupported texture type %s" % ext)
+
+def png_chunk(f, kind, data):
+    f.write(pack(">I", len(data)))
+    f.write(kind)
+    f.write(data)
+    f.write(pack(">I", zlib.crc32(kind + data) & 0xffffffff))
+
+def write_png(f, width, height, pixels, level=6):
+    # Writes RGBA pixels, bottom row first, as an 8 bit PNG to the binary
+    # file f. PNG stores the top row first.
+    rowlen = width * 4
+    if numpy and isinstance(pixels, numpy.ndarray):
+        raw = numpy.zeros((height, rowlen + 1), numpy.uint8)
+        raw[:, 1:] = pixels.reshape(height, rowlen)[::-1]
+        raw = raw.tobytes()
+    else:
+        pixels = bytes(pixels)
+        rows = []
+        for y in range(height - 1, -1, -1):
+            # each row starts with its filter type, none here
+            rows.append(b"\0")
+            rows.append(pixels[y * rowlen:(y + 1) * rowlen])
+        raw = b"".join(rows)
+    f.write(PNG_SIGNATURE)
+    png_chunk(f, b"IHDR", pack(">2I5B", width, height, 8, 6, 0, 0, 0))
+    png_chunk(f, b"IDAT", zlib.compress(raw, level))
+    png_chunk(f, b"IEND", b"")
+
+def convert_texture(job):
+    # Convert one texture to PNG and return a report on how it went. job is
+    # (path, output path, reconstruct_z).
+    path, output, reconstruct_z = job
+    result = {"path": path, "output": output, "ok": False, "bytes": 0}
+    start = time.perf_counter()
+    try:
+        result["bytes"] = os.path.getsize(path)
+        width, height, pixels = read_texture(path, reconstruct_z)
+        result["width"] = width
+        result["height"] = height
+        directory = os.path.dirname(output)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp = "%s.%d.tmp" % (output, os.getpid())
+        f = open(tmp, "wb")
+        try:
+            write_png(f, width, height, pixels)
+            f.close()
+            os.replace(tmp, output)
+        except:
+            f.close()
+            os.remove(tmp)
+            raise
+        result["ok"] = True
+    except Exception as e:
+        result["error"] = type(e).__name__
+        if str(e):
+            result["error"] += ": " + str(e)
+    result["time"] = time.perf_counter() - start
+    return result
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Convert .mbm and .dds "
+                                     "textures to PNG and report the results "
+                                     "as NDJSON")
+    parser.add_argument("paths",
+                        nargs="+",
+                        metavar="FILE|DIR|GLOB",
+                        help="textures, directories to search or globs")
+    parser.add_argument("-o",
+                        "--output",
+                        metavar="DIR",
+                        help="Directory for the PNG files, keeping the "
+                        "layout under the given directories and globs "
+                        "(default: next to each texture)")
+    parser.add_argument("-z",
+                        "--reconstruct-z",
+                        action="store_true",
+                        help="Compute the Z of normal maps instead of "
+                        "leaving it at full scale")
+    parser.add_argument("-j",
+                        "--jobs",
+                        type=int,
+                        default=os.cpu_count() or 1,
+                        help="Number of worker processes")
+    args = parser.parse_args()
+
+    jobs = []
+    for path, name in find_files(args.paths, (".mbm", ".dds")):
+        if args.output:
+            output = os.path.join(args.output, name)
+        else:
+            output = path
+        output = os.path.splitext(output)[0] + ".png"
+        jobs.append((path, output, args.reconstruct_z))
+    return run_batch(convert_texture, jobs, args.jobs, "convert_time")
+
+if __name__ == "__main__":
+    sys.exit(main())
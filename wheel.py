@@ -129,23 +129,25 @@ def adjust_wheel(wheel_node):
 
 def main():
     wheel_mu = sys.argv[1]
-    mu = Mu()
-    if not mu.read(wheel_mu):
-        print("could not read: " + fname)
-        raise
-    find_wheels(mu.obj)
-    if len(sys.argv) > 2:
-        text = open(sys.argv[2], "rt").read()
-        node = ConfigNode.load(text)
-        wheel = node.GetNode('Wheel')
-        if not wheel:
-            print("could not find Wheel")
-            sys.exit(1)
-        adjust_wheel(wheel)
-        mu.write("wheelout.mu")
-    else:
-        for w in wheel_colliders.keys():
-            node = wheel_cfg(w, wheel_colliders[w])
-            print("Wheel "+ node.ToString())
+    # meshes are only decoded if the model is written back out, so keep the
+    # file until then
+    with Mu() as mu:
+        if not mu.read(wheel_mu, lazy=True):
+            print("could not read: " + fname)
+            raise
+        find_wheels(mu.obj)
+        if len(sys.argv) > 2:
+            text = open(sys.argv[2], "rt").read()
+            node = ConfigNode.load(text)
+            wheel = node.GetNode('Wheel')
+            if not wheel:
+                print("could not find Wheel")
+                sys.exit(1)
+            adjust_wheel(wheel)
+            mu.write("wheelout.mu")
+        else:
+            for w in wheel_colliders.keys():
+                node = wheel_cfg(w, wheel_colliders[w])
+                print("Wheel "+ node.ToString())
 
 main()